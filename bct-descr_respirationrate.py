@@ -31,16 +31,10 @@ df = utils.stack_raw_task_data("bct")
 # cycle_df["cycle_accuracy"] = cycle_df.apply(cycle_accuracy, axis=1)
 
 
-cycle_df = df.groupby(["participant_id","cycle"]
-    ).agg({
-        "response_time": ["mean", "std"],
-        "press_accuracy": "last"
-    })
-cycle_df.columns = cycle_df.columns.map(lambda x: "-".join(x))
-cycle_df = cycle_df.rename(columns={"press_accuracy-last": "cycle_accuracy"})
-cycle_df["cycle_correct"] = cycle_df["cycle_accuracy"].eq("correct")
-
-participant_df = cycle_df.groupby("participant_id").mean()
+# Cycle accuracy is the accuracy of each cycle's last press.
+cycle_df = utils.score_bct_cycles(df)
+
+participant_df = cycle_df.groupby("participant_id", observed=True).mean()
 participant_df.columns = participant_df.columns.map(lambda x: x.replace("response", "cycle_response"))
 
 participant_df.to_csv(export_filepath_data, index=True, float_format="%.2f", sep="\t")
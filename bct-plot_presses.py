@@ -29,7 +29,7 @@ utils.make_pathdir_if_not_exists(export_filepath)
 
 df = utils.stack_raw_task_data("bct")
 
-df["rt_cumsum"] = df.groupby("participant_id")["response_time"].transform("cumsum")
+df["rt_cumsum"] = df.groupby("participant_id", observed=True)["response_time"].transform("cumsum")
 
 ############ Data wrangling.
 # # flip to a dataframe with RTs in columns and press count as index.
@@ -73,8 +73,8 @@ fig, (ax, axright) = plt.subplots(ncols=2, figsize=figsize,
     gridspec_kw=GRIDSPEC_KWARGS, sharey=True,
     constrained_layout=False)
 
-for i, (subj, subj_df) in enumerate(df.groupby("participant_id")):
-    for (resp, correct), _subj_df in subj_df.groupby(["response", "press_correct"]):
+for i, (subj, subj_df) in enumerate(df.groupby("participant_id", observed=True)):
+    for (resp, correct), _subj_df in subj_df.groupby(["response", "press_correct"], observed=True):
         if resp == "space":
             color = ACC_PALETTE[resp]
         else:
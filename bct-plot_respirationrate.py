@@ -34,7 +34,7 @@ df = utils.stack_raw_task_data("bct")
 ######
 ###### Then convert the press rate to respiration rate and smooth it.
 
-df["rt_sum"] = df.groupby("participant_id")["response_time"].transform(np.cumsum)
+df["rt_sum"] = df.groupby("participant_id", observed=True)["response_time"].transform(np.cumsum)
 
 # Convert cumulative press time to timedeltas.
 df["rt_sum_td"] = pd.to_timedelta(df["rt_sum"], unit="milliseconds")
@@ -46,7 +46,7 @@ cuts = pd.cut(df["rt_sum_td"], bins=seconds_index, labels=False)
 df["rt_sum_tdbin"] = pd.to_timedelta(cuts, unit="seconds")
 
 # Pivot to a table storing number of pressed per second in each cell.
-press_table = df.groupby(["participant_id", "rt_sum_tdbin"]).size(
+press_table = df.groupby(["participant_id", "rt_sum_tdbin"], observed=True).size(
     ).unstack("rt_sum_tdbin").reindex(columns=seconds_index)
 
 # Can't fillna because I want the LAST press to have NAs after it.
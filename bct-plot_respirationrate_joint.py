@@ -4,7 +4,7 @@ import seaborn as sns
 import utils
 
 
-df, sidecar = utils.load_all_data()
+df, sidecar = utils.load_all_data(columns=["rrate-mean", "rrate-std"])
 
 export_path = os.path.join(utils.load_config().bids_root,
     "derivatives", "matplotlib", "task-bct_rrate_desc_joint.png")
@@ -1,15 +1,20 @@
+import argparse
 import os
-import csv
-import json
-
-import numpy as np
-import pandas as pd
-from scipy import stats
 
+import eat_scoring
 import utils
 
 
 
+parser = argparse.ArgumentParser()
+parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes scoring trials.")
+parser.add_argument("-s", "--smooth", type=int, default=1,
+    help="Also write trial scores with both timecourses smoothed by a moving average"
+        " of this many samples.")
+args = parser.parse_args()
+if args.smooth < 1:
+    parser.error(f"--smooth must be at least 1 sample, got {args.smooth}")
+
 export_dir = os.path.join(utils.load_config().bids_root,
     "derivatives", "pandas")
 export_basename_data = "task-eat_acq-REPLACE_agg-sub_corrs.tsv"
@@ -21,6 +26,8 @@ utils.make_pathdir_if_not_exists(export_filepath_descr)
 # Add another output that includes individual video scores
 export_basename_trials = "task-eat_agg-trial_corrs.tsv"
 export_filepath_trials = os.path.join(export_dir, export_basename_trials)
+export_basename_smooth = f"task-eat_agg-trial_smooth-{args.smooth}_corrs.tsv"
+export_filepath_smooth = os.path.join(export_dir, export_basename_smooth)
 
 
 df = utils.stack_raw_task_data("eat")
@@ -31,39 +38,17 @@ df = utils.stack_raw_task_data("eat")
 #     ).set_index(["participant_id", "acquisition_id"])
 
 
-def get_correlation(ratings1, ratings2):
-    # trim to account for minor size differences
-    shortest_length = min((map(len, [ratings1, ratings2])))
-    ratings1 = ratings1[:shortest_length]
-    ratings2 = ratings2[:shortest_length]
-    # ratings1 = np.convolve(ratings1, np.ones(4), "valid") / 4
-    # ratings2 = np.convolve(ratings2, np.ones(4), "valid") / 4
-    ratings1_z = stats.zscore(ratings1, nan_policy="raise")
-    ratings2_z = stats.zscore(ratings2, nan_policy="raise")
-    r, _ = stats.spearmanr(ratings1_z, ratings2_z)
-    rz = np.arctanh(r)
-    return rz
-
-def empathy_accuracy_scores(ser):
-    participant_timecourse = ser.tolist()
-    _, _, video_id = ser.name
-    # grab true timecourses from SEND dataset
-    actor_timecourse, crowd_timecourse = utils.get_true_timecourses(video_id)
-    # correlate
-    r_actor = get_correlation(actor_timecourse, participant_timecourse)
-    r_crowd = get_correlation(crowd_timecourse, participant_timecourse)
-    return (r_actor, r_crowd)
-
-
-trial_df = df.reset_index(
-    ).groupby(["participant_id", "acquisition_id", "stimulus"]
-    )["response"].apply(empathy_accuracy_scores)
-
-trial_df = trial_df.apply(pd.Series)
-trial_df.columns = ["actor_correlation", "crowd_correlation"]
+# Score all trials of each video at once (with SEND ratings decoded just once),
+# on every accuracy metric. Participant summaries stick to the Spearman correlations.
+trial_df = eat_scoring.score_eat_trials(df, n_jobs=args.jobs)
 
 trial_df.to_csv(export_filepath_trials, index=True, float_format="%.3f", sep="\t")
 
+# Smoothed scores go to their own file, so the outputs above stay comparable across runs.
+if args.smooth > 1:
+    smooth_df = eat_scoring.score_eat_trials(df, n_jobs=args.jobs, smooth=args.smooth)
+    smooth_df.to_csv(export_filepath_smooth, index=True, float_format="%.3f", sep="\t")
+
 
 # cycle_df = df.groupby(["participant_id","cycle"]
 #     ).agg({
@@ -74,8 +59,9 @@ trial_df.to_csv(export_filepath_trials, index=True, float_format="%.3f", sep="\t
 # cycle_df = cycle_df.rename(columns={"press_accuracy-last": "cycle_accuracy"})
 # cycle_df["cycle_correct"] = cycle_df["cycle_accuracy"].eq("correct")
 
-for acquisition_id, acquisition_df in trial_df.groupby("acquisition_id"):
-    participant_df = acquisition_df.groupby("participant_id").agg(["count", "mean", "std", "min", "max"])
+correlation_columns = ["actor_correlation", "crowd_correlation"]
+for acquisition_id, acquisition_df in trial_df[correlation_columns].groupby("acquisition_id", observed=True):
+    participant_df = acquisition_df.groupby("participant_id", observed=True).agg(["count", "mean", "std", "min", "max"])
     participant_df.columns = participant_df.columns.map(lambda x: "-".join(x))
     export_path_data = export_filepath_data.replace("acq-REPLACE", acquisition_id)
     export_path_descr = export_filepath_descr.replace("acq-REPLACE", acquisition_id)
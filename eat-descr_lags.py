@@ -0,0 +1,43 @@
+"""Lagged empathic accuracy. Participants' ratings trail the actor's
+by a few seconds, so correlate them at every lag up to eat_max_lag_s
+(in config.json) and keep the peak correlation and its lag.
+"""
+import argparse
+import os
+
+import eat_scoring
+import utils
+
+
+config = utils.load_config()
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-l", "--max-lag", type=float, default=config.eat_max_lag_s,
+    help="Largest lag (in seconds, either direction) to correlate at.")
+parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes scoring trials.")
+args = parser.parse_args()
+
+export_dir = os.path.join(config.bids_root, "derivatives", "pandas")
+export_filepath_trials = os.path.join(export_dir, "task-eat_agg-trial_lags.tsv")
+export_filepath_data = os.path.join(export_dir, "task-eat_acq-REPLACE_agg-sub_lags.tsv")
+export_filepath_descr = os.path.join(export_dir, "task-eat_acq-REPLACE_agg-sub_lags_descr.tsv")
+utils.make_pathdir_if_not_exists(export_filepath_descr)
+
+max_lag = int(round(args.max_lag * config.eat_sample_rate_hz))
+
+
+df = utils.stack_raw_task_data("eat", columns=["stimulus", "response"])
+
+trial_df = eat_scoring.score_eat_lags(df, max_lag, n_jobs=args.jobs)
+# lags in seconds, positive when the participant trails the reference
+trial_df[["actor_lag", "crowd_lag"]] /= config.eat_sample_rate_hz
+
+trial_df.to_csv(export_filepath_trials, index=True, float_format="%.3f", sep="\t")
+
+for acquisition_id, acquisition_df in trial_df.groupby("acquisition_id", observed=True):
+    participant_df = acquisition_df.groupby("participant_id", observed=True).agg(["count", "mean", "std", "min", "max"])
+    participant_df.columns = participant_df.columns.map(lambda x: "-".join(x))
+    export_path_data = export_filepath_data.replace("acq-REPLACE", acquisition_id)
+    export_path_descr = export_filepath_descr.replace("acq-REPLACE", acquisition_id)
+    participant_df.to_csv(export_path_data, index=True, float_format="%.3f", sep="\t")
+    participant_df.describe().to_csv(export_path_descr, index_label="statistic", float_format="%.2f", sep="\t")
@@ -0,0 +1,30 @@
+"""Chance baseline for trial-level empathic accuracy. Emotion timecourses
+are strongly autocorrelated, so compare each trial's correlation with
+those of surrogate ratings that keep that autocorrelation but not the
+alignment with the video (circular shifts or phase randomization).
+"""
+import argparse
+import os
+
+import eat_scoring
+import utils
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--surrogates", type=int, default=1000, help="Number of surrogates per trial.")
+parser.add_argument("-m", "--method", default="shift", choices=eat_scoring.SURROGATE_METHODS)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes scoring trials.")
+args = parser.parse_args()
+
+export_filepath = os.path.join(utils.load_config().bids_root,
+    "derivatives", "pandas", f"task-eat_agg-trial_surrogates-{args.method}.tsv")
+utils.make_pathdir_if_not_exists(export_filepath)
+
+
+df = utils.stack_raw_task_data("eat", columns=["stimulus", "response"])
+
+trial_df = eat_scoring.score_eat_surrogates(df, n_surrogates=args.surrogates,
+    method=args.method, seed=args.seed, n_jobs=args.jobs)
+
+trial_df.to_csv(export_filepath, index=True, float_format="%.3f", sep="\t")
@@ -0,0 +1,35 @@
+"""Time-resolved empathic accuracy. Correlate each trial with the actor
+and crowd ratings in a window (eat_window_s in config.json) sliding one
+sample at a time, to see where in each video participants track them.
+"""
+import argparse
+import os
+
+import eat_scoring
+import utils
+
+
+config = utils.load_config()
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-w", "--window", type=float, default=config.eat_window_s,
+    help="Window length in seconds.")
+parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes scoring trials.")
+args = parser.parse_args()
+
+export_filepath = os.path.join(config.bids_root, "derivatives", "pandas", "task-eat_agg-window_corrs.tsv")
+utils.make_pathdir_if_not_exists(export_filepath)
+
+window = int(round(args.window * config.eat_sample_rate_hz))
+if window < 3:
+    parser.error(f"--window must span at least 3 samples ({3 / config.eat_sample_rate_hz:g} s"
+        f" at {config.eat_sample_rate_hz} Hz), got {window}")
+
+
+df = utils.stack_raw_task_data("eat", columns=["stimulus", "response"])
+
+window_df = eat_scoring.score_eat_windows(df, window, n_jobs=args.jobs)
+# window_center in seconds
+window_df.insert(3, "window_center",
+    (window_df.pop("window_start") + (window - 1) / 2) / config.eat_sample_rate_hz)
+window_df.to_csv(export_filepath, index=False, float_format="%.3f", sep="\t")
@@ -4,7 +4,8 @@ import seaborn as sns
 import utils
 
 
-df, sidecar = utils.load_all_data()
+df, sidecar = utils.load_all_data(
+    columns=["intervention", "attention_location_2", "actor_correlation-mean_delta"])
 
 export_path = os.path.join(utils.load_config().bids_root,
     "derivatives", "matplotlib", "task-eat_intrvXattention.png")
@@ -23,7 +23,9 @@ participants = utils.load_participant_file()
 
 participant_palette = utils.load_participant_palette()
 
-df = utils.stack_raw_task_data("eat")
+df = utils.stack_raw_task_data("eat", stimuli=video_id_list,
+    participants=participants.index, columns=["stimulus", "response"])
+true_timecourses = utils.get_true_timecourses_many(video_id_list, transform="zscore")
 
 
 SAMPLE_RATE = .5
@@ -40,9 +42,7 @@ for video_id in video_id_list:
         col = 1
         row = setB_video_ids.index(video_id)
     ax = axes[row, col]
-    actor_ratings, crowd_ratings = utils.get_true_timecourses(video_id)
-    actor_ratings = stats.zscore(actor_ratings, nan_policy="raise")
-    crowd_ratings = stats.zscore(crowd_ratings, nan_policy="raise")
+    actor_ratings, crowd_ratings = true_timecourses[video_id]
     # plot the actor and crowd nice and bold
     xvals1 = np.arange(0, len(actor_ratings)*SAMPLE_RATE, SAMPLE_RATE)
     xvals2 = np.arange(0, len(crowd_ratings)*SAMPLE_RATE, SAMPLE_RATE)
@@ -51,9 +51,10 @@ for video_id in video_id_list:
     ax.text(1, 0, video_id, ha="right", va="bottom", transform=ax.transAxes,
         fontsize=6)
     # loop over all the subjects
+    video_df = df[df["stimulus"].eq(video_id)]
     for participant_id in participants.index:
         color = participant_palette[participant_id]
-        participant_ratings = df.query(f"stimulus=='{video_id}'").loc[participant_id, "response"].tolist()
+        participant_ratings = video_df.loc[participant_id, "response"].tolist()
         participant_ratings = stats.zscore(participant_ratings, nan_policy="raise")
         xvals = np.arange(0, len(participant_ratings)*SAMPLE_RATE, SAMPLE_RATE)
         ax.plot(xvals, participant_ratings, color=color, alpha=.25, lw=1, ls="solid", zorder=1)
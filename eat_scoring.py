@@ -0,0 +1,411 @@
+"""Empathic accuracy engines for the EAT trials: accuracy metrics,
+lagged and sliding-window correlations, and surrogate null distributions.
+Every trial of a video is scored at once, as arrays.
+"""
+import utils
+
+
+def pearson_rows(ratings, reference):
+    """Pearson correlation of every row of ratings with reference.
+    Rows and reference must have the same length. Constant rows give NaN.
+    """
+    import numpy as np
+    ratings = ratings - ratings.mean(axis=-1, keepdims=True)
+    reference = reference - reference.mean()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (ratings @ reference) / np.sqrt(
+            np.einsum("ij,ij->i", ratings, ratings) * (reference @ reference))
+
+def spearman_rows(ratings, reference):
+    """Spearman correlation of every row of ratings with reference.
+    Ties get average ranks, as in scipy.stats.spearmanr. See pearson_rows.
+    """
+    from scipy import stats
+    return pearson_rows(stats.rankdata(ratings, axis=-1), stats.rankdata(reference))
+
+def eat_trial_bounds(df):
+    """Group the stacked EAT samples into trials (participant, acquisition, stimulus).
+    Returns the trial keys as a DataFrame (sorted like a groupby), the sample
+    responses reordered so each trial is contiguous, and each trial's
+    first sample and number of samples in that array.
+    """
+    import numpy as np
+    keys = ["participant_id", "acquisition_id", "stimulus"]
+    df = df.reset_index()
+    trial_codes = df.groupby(keys, observed=True).ngroup().to_numpy()
+    order = np.argsort(trial_codes, kind="stable")
+    trial_codes = trial_codes[order]
+    is_start = np.ones(len(order), dtype=bool)
+    is_start[1:] = trial_codes[1:] != trial_codes[:-1]
+    starts = np.flatnonzero(is_start)
+    lengths = np.diff(np.append(starts, len(order)))
+    responses = df["response"].to_numpy(dtype=float)[order]
+    trial_keys = df[keys].iloc[order[starts]].reset_index(drop=True)
+    return trial_keys, responses, starts, lengths
+
+def trial_batches(responses, starts, lengths, *references, min_length=1):
+    """Group trials for scoring against the reference ratings (eg, actor and crowd).
+
+    Each trial is trimmed to the shortest of it and the references (to account
+    for minor size differences), and trials of equal trimmed length are
+    batched so each batch is scored in one array operation. Trials trimmed
+    to fewer than min_length samples are skipped.
+    Yields each batch's trial positions in starts, its ratings (one row per
+    trial), and the references trimmed to the same length.
+    """
+    import numpy as np
+    references = [ np.asarray(reference, dtype=float) for reference in references ]
+    trimmed_lengths = np.minimum(lengths, min(len(reference) for reference in references))
+    for length in np.unique(trimmed_lengths[trimmed_lengths >= min_length]):
+        batch = np.flatnonzero(trimmed_lengths == length)
+        ratings = responses[starts[batch, None] + np.arange(length)]
+        trimmed_references = [ reference[:length] for reference in references ]
+        if np.isnan(ratings).any() or any(np.isnan(reference).any() for reference in trimmed_references):
+            raise ValueError("The input contains nan values")
+        yield batch, ratings, *trimmed_references
+
+def range_sums(x, starts, ends):
+    """Sums of x over samples starts to ends (exclusive) along the last axis,
+    from one cumulative sum, so each range costs the same however long it is.
+    """
+    import numpy as np
+    sums = np.concatenate([np.zeros(x.shape[:-1] + (1,)), np.cumsum(x, axis=-1)], axis=-1)
+    return sums[..., ends] - sums[..., starts]
+
+def centered(ratings, reference):
+    """Subtract the mean of every row of ratings and of reference.
+    Centering before summing products keeps those sums well conditioned.
+    """
+    return ratings - ratings.mean(axis=-1, keepdims=True), reference - reference.mean()
+
+EAT_ACCURACY_METRICS = ["correlation", "pearson", "concordance", "rmse", "mae"]
+
+def moving_average_rows(ratings, window):
+    """Moving average of every row (like np.convolve(..., "valid")), see range_sums."""
+    import numpy as np
+    if window <= 1:
+        return ratings
+    window_starts = np.arange(ratings.shape[-1] - window + 1)
+    return range_sums(ratings, window_starts, window_starts + window) / window
+
+def accuracy_rows(ratings, reference):
+    """All EAT_ACCURACY_METRICS of every row of ratings against reference, in one pass.
+    correlation is the Fisher-z Spearman correlation, pearson and concordance
+    (Lin's concordance correlation coefficient) are plain coefficients, and
+    rmse and mae are in the units of the ratings.
+    Returns an array with one column per metric.
+    """
+    import numpy as np
+    deviations = ratings - ratings.mean(axis=-1, keepdims=True)
+    reference_deviations = reference - reference.mean()
+    covariances = deviations @ reference_deviations / reference.size
+    variances = np.einsum("ij,ij->i", deviations, deviations) / reference.size
+    reference_variance = reference_deviations @ reference_deviations / reference.size
+    errors = ratings - reference
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pearson = covariances / np.sqrt(variances * reference_variance)
+        concordance = 2 * covariances / (variances + reference_variance
+            + (ratings.mean(axis=-1) - reference.mean()) ** 2)
+        # Spearman only uses ranks, so nothing needs z-scoring first.
+        spearman_z = np.arctanh(spearman_rows(ratings, reference))
+        return np.column_stack([spearman_z, pearson, concordance,
+            np.sqrt(np.mean(errors ** 2, axis=-1)), np.mean(np.abs(errors), axis=-1)])
+
+def score_video_trials(responses, starts, lengths, actor, crowd, smooth=1):
+    """Accuracy of one video's trials against its actor and crowd ratings.
+
+    Trials are trimmed and batched by trial_batches. With smooth > 1, both
+    are first smoothed with a moving average of that many samples, which
+    must leave at least 3 samples of every trial to correlate.
+    Returns an array with one row per trial and columns for each
+    of EAT_ACCURACY_METRICS, each for actor then crowd.
+    """
+    import numpy as np
+    if smooth < 1:
+        raise ValueError(f"smooth must be at least 1 sample, got {smooth}")
+    n_metrics = len(EAT_ACCURACY_METRICS)
+    scores = np.empty((len(starts), 2 * n_metrics))
+    for column, reference in enumerate([actor, crowd]):
+        for batch, ratings, reference in trial_batches(responses, starts, lengths, reference):
+            if smooth > 1 and reference.size - smooth + 1 < 3:
+                raise ValueError(f"Smoothing over {smooth} samples leaves fewer than 3 samples"
+                    f" of {reference.size}-sample trials, use a shorter window")
+            scores[batch, column::2] = accuracy_rows(moving_average_rows(ratings, smooth),
+                moving_average_rows(reference, smooth))
+    return scores
+
+
+def _score_shard(score_video, video_id, responses, lengths, trial_kwargs, kwargs):
+    """Pool worker for map_video_shards, scoring some trials of one video."""
+    import numpy as np
+    actor, crowd = utils.get_true_timecourses(video_id)
+    starts = np.cumsum(lengths) - lengths
+    return score_video(responses, starts, lengths, actor, crowd, **trial_kwargs, **kwargs)
+
+def map_video_shards(trial_bounds, score_video, n_jobs=1, trial_kwargs=None, **kwargs):
+    """Run a score_video_* engine over the trials of every video, given the
+    eat_trial_bounds of the stacked EAT data.
+
+    score_video(responses, starts, lengths, actor, crowd, **trial_kwargs, **kwargs)
+    scores some trials of one video. trial_kwargs values are sequences with one
+    item per trial (eg, random seeds), passed along for just those trials.
+    With n_jobs > 1, each video's trials are split into shards scored on a
+    pool of n_jobs processes. Ratings are decoded into the SEND cache first,
+    so workers only memory-map the same cache files (shared through the
+    OS page cache) instead of each opening the archive.
+    Returns the trial keys (see eat_trial_bounds) and, for each shard,
+    the trials' positions in the keys and what score_video returned.
+    """
+    import numpy as np
+    from concurrent.futures import ProcessPoolExecutor
+    trial_keys, responses, starts, lengths = trial_bounds
+    true_timecourses = utils.get_true_timecourses_many(trial_keys["stimulus"].unique())
+    shards = []
+    for video_id, video_trials in trial_keys.groupby("stimulus", observed=True).indices.items():
+        n_shards = max(1, min(n_jobs, len(video_trials)))
+        shards.extend( (video_id, shard) for shard in np.array_split(video_trials, n_shards) )
+    shard_kwargs = [ { name: [ values[i] for i in shard ] for name, values in (trial_kwargs or {}).items() }
+        for _, shard in shards ]
+    if n_jobs > 1 and len(shards) > 1:
+        shard_responses = [ np.concatenate([ responses[start:start+length]
+                for start, length in zip(starts[shard], lengths[shard]) ])
+            for _, shard in shards ]
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_score_shard, [score_video] * len(shards),
+                [ video_id for video_id, _ in shards ], shard_responses,
+                [ lengths[shard] for _, shard in shards ], shard_kwargs, [kwargs] * len(shards)))
+    else:
+        results = [ score_video(responses, starts[shard], lengths[shard],
+                *true_timecourses[video_id], **shard_trial_kwargs, **kwargs)
+            for (video_id, shard), shard_trial_kwargs in zip(shards, shard_kwargs) ]
+    return trial_keys, [ (shard, result) for (_, shard), result in zip(shards, results) ]
+
+def trial_scores_frame(trial_keys, shard_results, columns):
+    """Put per-trial score arrays from map_video_shards back in trial order, as a DataFrame
+    indexed by participant, acquisition, and stimulus.
+    """
+    import numpy as np
+    import pandas as pd
+    scores = np.empty((len(trial_keys), len(columns)))
+    for shard, shard_scores in shard_results:
+        scores[shard] = shard_scores
+    return pd.DataFrame(scores, columns=columns, index=pd.MultiIndex.from_frame(trial_keys))
+
+def score_eat_trials(df, n_jobs=1, smooth=1):
+    """Accuracy of every EAT trial in the stacked data, see score_video_trials.
+    Trials are scored on n_jobs processes, see map_video_shards.
+    Returns a DataFrame with actor_<metric> and crowd_<metric> columns
+    for each of EAT_ACCURACY_METRICS (actor_correlation, crowd_correlation,
+    actor_pearson, ...), indexed by participant, acquisition, and stimulus.
+    """
+    trial_keys, shard_results = map_video_shards(eat_trial_bounds(df), score_video_trials,
+        n_jobs, smooth=smooth)
+    columns = [ f"{source}_{metric}" for metric in EAT_ACCURACY_METRICS for source in ["actor", "crowd"] ]
+    return trial_scores_frame(trial_keys, shard_results, columns)
+
+
+def lagged_correlation_rows(ratings, reference, max_lag):
+    """Pearson correlation of every row of ratings with reference at each lag
+    from -max_lag to max_lag samples, computed over the overlapping samples.
+    A positive lag pairs ratings[t + lag] with reference[t], ie, the ratings
+    trail the reference. The cross products for all lags come from one FFT per
+    row and the overlap sums from cumulative sums, so no lag is looped over.
+    max_lag is capped at half the length (and so that at least 3 samples
+    overlap), since correlations over a few samples are near +/-1 by chance
+    and would pull the peak toward the edge lags.
+    Returns the correlations (one column per lag) and the lags.
+    """
+    import numpy as np
+    length = reference.size
+    max_lag = max(0, min(max_lag, length // 2, length - 3))
+    lags = np.arange(-max_lag, max_lag + 1)
+    ratings, reference = centered(ratings, reference)
+    n_fft = 2 ** int(np.ceil(np.log2(2 * length - 1)))
+    cross = np.fft.irfft(np.fft.rfft(ratings, n_fft, axis=-1)
+        * np.conj(np.fft.rfft(reference, n_fft)), n_fft, axis=-1)[:, lags % n_fft]
+    n_overlap = length - np.abs(lags)
+    ratings_starts, reference_starts = np.maximum(lags, 0), np.maximum(-lags, 0)
+    ratings_sum = range_sums(ratings, ratings_starts, ratings_starts + n_overlap)
+    ratings_squares = range_sums(ratings ** 2, ratings_starts, ratings_starts + n_overlap)
+    reference_sum = range_sums(reference, reference_starts, reference_starts + n_overlap)
+    reference_squares = range_sums(reference ** 2, reference_starts, reference_starts + n_overlap)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlations = (cross - ratings_sum * reference_sum / n_overlap) / np.sqrt(
+            (ratings_squares - ratings_sum ** 2 / n_overlap)
+            * (reference_squares - reference_sum ** 2 / n_overlap))
+    return correlations, lags
+
+def score_video_lags(responses, starts, lengths, actor, crowd, max_lag):
+    """Peak lagged correlation of one video's trials with its actor and crowd ratings.
+
+    Trials are trimmed and batched by trial_batches, then correlated
+    at every lag up to max_lag samples (see lagged_correlation_rows);
+    trials of fewer than 3 samples are left NaN.
+    Returns an array with one row per trial of the Fisher-z peak correlation
+    and its lag (in samples) for the actor, then the same for the crowd.
+    """
+    import numpy as np
+    scores = np.full((len(starts), 4), np.nan)
+    for column, reference in enumerate([actor, crowd]):
+        for batch, ratings, reference in trial_batches(responses, starts, lengths, reference, min_length=3):
+            correlations, lags = lagged_correlation_rows(ratings, reference, max_lag)
+            valid = ~np.isnan(correlations).all(axis=-1)
+            peaks = np.argmax(np.where(np.isnan(correlations), -np.inf, correlations), axis=-1)
+            peak_correlations = np.clip(correlations[np.arange(len(batch)), peaks], -1, 1)
+            with np.errstate(divide="ignore"):
+                scores[batch[valid], 2 * column] = np.arctanh(peak_correlations[valid])
+            scores[batch[valid], 2 * column + 1] = lags[peaks[valid]]
+    return scores
+
+def score_eat_lags(df, max_lag, n_jobs=1):
+    """Peak lagged correlation of every EAT trial in the stacked data, see score_video_lags.
+    Trials are scored on n_jobs processes, see map_video_shards.
+    Returns a DataFrame with actor_ and crowd_ peak_correlation and lag
+    (in samples) columns, indexed by participant, acquisition, and stimulus.
+    """
+    trial_keys, shard_results = map_video_shards(eat_trial_bounds(df), score_video_lags,
+        n_jobs, max_lag=max_lag)
+    columns = ["actor_peak_correlation", "actor_lag", "crowd_peak_correlation", "crowd_lag"]
+    return trial_scores_frame(trial_keys, shard_results, columns)
+
+
+def window_correlation_rows(ratings, reference, window):
+    """Pearson correlation of every row of ratings with reference in each
+    sliding window of window samples (step 1). Window sums of both series,
+    their squares, and their products come from range_sums.
+    Returns the correlations, one column per window start.
+    """
+    import numpy as np
+    if window < 3:
+        raise ValueError(f"Windows need at least 3 samples to correlate, got {window}")
+    ratings, reference = centered(ratings, reference)
+    window_starts = np.arange(reference.size - window + 1)
+    def window_sums(x):
+        return range_sums(x, window_starts, window_starts + window)
+    ratings_sum = window_sums(ratings)
+    reference_sum = window_sums(reference)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (window_sums(ratings * reference) - ratings_sum * reference_sum / window) / np.sqrt(
+            (window_sums(ratings ** 2) - ratings_sum ** 2 / window)
+            * (window_sums(reference ** 2) - reference_sum ** 2 / window))
+
+def score_video_windows(responses, starts, lengths, actor, crowd, window):
+    """Sliding-window correlations of one video's trials with its actor and crowd ratings.
+
+    Trials are trimmed to the shortest of them and both reference ratings
+    (so actor and crowd share windows) and batched by trial_batches; trials
+    shorter than one window are skipped. Returns, one row per window, the trial's position
+    in starts, the window's first sample, and the actor and crowd
+    correlations (as an array of two columns).
+    """
+    import numpy as np
+    trials, window_starts, scores = [], [], []
+    for batch, ratings, actor, crowd in trial_batches(responses, starts, lengths, actor, crowd,
+            min_length=window):
+        actor_correlations = window_correlation_rows(ratings, actor, window)
+        crowd_correlations = window_correlation_rows(ratings, crowd, window)
+        n_windows = actor_correlations.shape[-1]
+        trials.append(np.repeat(batch, n_windows))
+        window_starts.append(np.tile(np.arange(n_windows), len(batch)))
+        scores.append(np.column_stack([actor_correlations.ravel(), crowd_correlations.ravel()]))
+    if not trials:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty((0, 2))
+    return np.concatenate(trials), np.concatenate(window_starts), np.concatenate(scores)
+
+def score_eat_windows(df, window, n_jobs=1):
+    """Sliding-window correlations of every EAT trial in the stacked data, see score_video_windows.
+    Trials are scored on n_jobs processes, see map_video_shards.
+    Returns a DataFrame with one row per window: participant, acquisition,
+    stimulus, the window's first sample, and the actor_pearson and
+    crowd_pearson correlations, sorted by trial and window.
+    """
+    import pandas as pd
+    trial_keys, shard_results = map_video_shards(eat_trial_bounds(df), score_video_windows,
+        n_jobs, window=window)
+    window_dfs = []
+    for shard, (trials, window_starts, scores) in shard_results:
+        window_df = trial_keys.iloc[shard[trials]].reset_index(drop=True)
+        window_df["window_start"] = window_starts
+        window_df[["actor_pearson", "crowd_pearson"]] = scores
+        window_dfs.append(window_df)
+    return pd.concat(window_dfs, ignore_index=True).sort_values(
+        ["participant_id", "acquisition_id", "stimulus", "window_start"], ignore_index=True)
+
+
+SURROGATE_METHODS = ["shift", "phase"]
+
+def surrogate_correlations(ratings, reference, n_surrogates, method, rng):
+    """Fisher-z Spearman correlations of n_surrogates surrogates of ratings with reference.
+
+    Surrogates keep the autocorrelation of the ratings but break their
+    alignment with the reference. "shift" rotates the ratings by a random
+    number of samples (so the ranks are just rotated, not recomputed) and
+    "phase" randomizes the phases of their Fourier spectrum.
+    rng is a numpy Generator. All surrogates are built and scored as one matrix.
+    """
+    import numpy as np
+    from scipy import stats
+    length = len(ratings)
+    if method == "shift":
+        shifts = rng.integers(1, length, n_surrogates)
+        ranks = stats.rankdata(ratings)[(np.arange(length) + shifts[:, None]) % length]
+        correlations = pearson_rows(ranks, stats.rankdata(reference))
+    elif method == "phase":
+        spectrum = np.fft.rfft(ratings)
+        phases = rng.uniform(0, 2 * np.pi, (n_surrogates, spectrum.size))
+        phases[:, 0] = 0 # keep the mean
+        if length % 2 == 0:
+            phases[:, -1] = 0 # and the Nyquist term real
+        surrogates = np.fft.irfft(spectrum * np.exp(1j * phases), length, axis=-1)
+        correlations = spearman_rows(surrogates, reference)
+    else:
+        raise ValueError(f"Unknown surrogate method {method}, expected one of {SURROGATE_METHODS}")
+    with np.errstate(divide="ignore"):
+        return np.arctanh(correlations)
+
+def score_video_surrogates(responses, starts, lengths, actor, crowd, n_surrogates, method, seeds):
+    """Compare each of one video's trials with a surrogate null distribution.
+
+    Trials are trimmed and batched by trial_batches (trials of fewer than
+    3 samples are left NaN) and scored against surrogates drawn from their
+    own random stream (seeds holds one SeedSequence per trial), so results
+    don't depend on how trials are split across workers.
+    Returns an array with one row per trial of the observed Fisher-z Spearman
+    correlation, its z-score against the null, and its percentile in the
+    null, for the actor and then the same for the crowd.
+    """
+    import numpy as np
+    scores = np.full((len(starts), 6), np.nan)
+    rngs = [ np.random.default_rng(seed) for seed in seeds ]
+    for column, reference in enumerate([actor, crowd]):
+        for batch, ratings, reference in trial_batches(responses, starts, lengths, reference, min_length=3):
+            with np.errstate(divide="ignore"):
+                observed = np.arctanh(spearman_rows(ratings, reference))
+            for trial, trial_ratings, trial_observed in zip(batch, ratings, observed):
+                null = surrogate_correlations(trial_ratings, reference, n_surrogates, method, rngs[trial])
+                null = null[np.isfinite(null)]
+                if not np.isfinite(trial_observed) or null.size < 2:
+                    scores[trial, 3 * column] = trial_observed
+                    continue
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    null_z = (trial_observed - null.mean()) / null.std(ddof=1)
+                percentile = 100 * (np.sum(null < trial_observed) + np.sum(null == trial_observed) / 2) / null.size
+                scores[trial, 3 * column:3 * column + 3] = [trial_observed, null_z, percentile]
+    return scores
+
+def score_eat_surrogates(df, n_surrogates=1000, method="shift", seed=0, n_jobs=1):
+    """Surrogate null comparison of every EAT trial in the stacked data, see score_video_surrogates.
+
+    Each trial gets its own random stream spawned from seed, so results are
+    reproducible and identical for any n_jobs (see map_video_shards).
+    Returns a DataFrame with actor_ and crowd_ correlation, null_z, and
+    null_percentile columns, indexed by participant, acquisition, and stimulus.
+    """
+    import numpy as np
+    trial_bounds = eat_trial_bounds(df)
+    seeds = np.random.SeedSequence(seed).spawn(len(trial_bounds[0]))
+    trial_keys, shard_results = map_video_shards(trial_bounds, score_video_surrogates, n_jobs,
+        trial_kwargs={"seeds": seeds}, n_surrogates=n_surrogates, method=method)
+    columns = [ f"{source}_{measure}" for source in ["actor", "crowd"]
+        for measure in ["correlation", "null_z", "null_percentile"] ]
+    return trial_scores_frame(trial_keys, shard_results, columns)
@@ -2,7 +2,6 @@ import os
 import argparse
 import numpy as np
 import pandas as pd
-from scipy import stats
 
 import utils
 
@@ -23,22 +22,20 @@ export_fname = os.path.join(utils.load_config().bids_root, "derivatives",
 participant_list = utils.load_participant_file().index.tolist()
 participant_palette = utils.load_participant_palette()
 
-df = utils.stack_raw_task_data("eat")
-
-
 SAMPLE_RATE = .5
 FIGSIZE = (4, 3)
 VIDEO_ID = "ID113_vid3"
 
-actor_ratings, crowd_ratings = utils.get_true_timecourses(VIDEO_ID)
-actor_ratings = stats.zscore(actor_ratings, nan_policy="raise")
-crowd_ratings = stats.zscore(crowd_ratings, nan_policy="raise")
+df = utils.stack_raw_task_data("eat", stimuli=[VIDEO_ID], columns=["response"],
+    participants=["sub-001", "sub-002", "sub-003", "sub-004"])
+
+actor_ratings, crowd_ratings = utils.get_true_timecourses(VIDEO_ID, transform="zscore")
 xvals = np.arange(0, len(actor_ratings)*SAMPLE_RATE, SAMPLE_RATE)
 frames = range(0, len(xvals))
-p1_ratings = df.query(f"stimulus=='{VIDEO_ID}'").loc["sub-001", "response"].tolist()
-p2_ratings = df.query(f"stimulus=='{VIDEO_ID}'").loc["sub-002", "response"].tolist()
-p3_ratings = df.query(f"stimulus=='{VIDEO_ID}'").loc["sub-003", "response"].tolist()
-p4_ratings = df.query(f"stimulus=='{VIDEO_ID}'").loc["sub-004", "response"].tolist()
+p1_ratings = df.loc["sub-001", "response"].tolist()
+p2_ratings = df.loc["sub-002", "response"].tolist()
+p3_ratings = df.loc["sub-003", "response"].tolist()
+p4_ratings = df.loc["sub-004", "response"].tolist()
 
 fig, ax = plt.subplots(figsize=FIGSIZE, constrained_layout=True)
 
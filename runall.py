@@ -0,0 +1,406 @@
+"""Run the analysis pipeline, rebuilding only the stages that are out of date.
+
+Each stage declares the files it reads and writes (paths or glob patterns),
+and stages are linked into a graph wherever one stage's output pattern is
+another stage's input pattern. A stage reruns when any of its outputs are
+missing or when the content hash of its script, utils.py, config.json or any
+of its inputs differs from its last successful run. Hashes are stored in
+derivatives/cache/runall_state.json.
+
+Independent stages run concurrently across processes (-j), and each
+stage's output goes to its own log in derivatives/logs. With --warm, the
+analysis scripts are run as __main__ inside worker processes that have
+already imported pandas, scipy, pingouin, seaborn, etc., and frames loaded
+through utils (e.g., utils.load_all_data) are shared between scripts.
+
+    python runall.py                    # rebuild whatever is stale
+    python runall.py -n                 # list stale stages without running them
+    python runall.py "survey-anova*"    # only these stages (and anything upstream)
+    python runall.py -f eat-joint.py    # rerun even if up to date
+    python runall.py -j 8               # run up to 8 stages at once
+    python runall.py -j 8 --warm        # same, without re-importing per script
+"""
+import argparse
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import utils
+
+
+# Scripts and code inputs are found next to this file, wherever it's run from.
+code_dir = os.path.dirname(os.path.abspath(__file__))
+bids_root = utils.load_config().bids_root
+state_filepath = os.path.join(utils.cache_dir(), "runall_state.json")
+log_dir = os.path.join(bids_root, "derivatives", "logs")
+
+def code_path(name):
+    return os.path.join(code_dir, name)
+
+def pandas_path(name):
+    return os.path.join(bids_root, "derivatives", "pandas", name)
+
+def pingouin_path(name):
+    return os.path.join(bids_root, "derivatives", "pingouin", name)
+
+def matplotlib_path(name):
+    return os.path.join(bids_root, "derivatives", "matplotlib", name)
+
+
+# Files every stage depends on, besides its own script.
+COMMON_INPUTS = [code_path("utils.py"), code_path("config.json")]
+# Module of the empathic accuracy engines, read by the EAT scoring stages.
+EAT_SCORING = code_path("eat_scoring.py")
+
+SOURCE_BCT = os.path.join(bids_root, "sourcedata", "**", "*task-bct*.json")
+SOURCE_EAT = os.path.join(bids_root, "sourcedata", "**", "*task-eat*.json")
+SOURCE_SURVEY = os.path.join(bids_root, "sourcedata", "*.sav")
+SEND_RATINGS = [os.path.join(bids_root, "stimuli", "SENDv1_featuresRatings_pw.zip"), code_path("db_pword.txt")]
+
+PARTICIPANTS = os.path.join(bids_root, "participants.tsv")
+RAW_BCT = os.path.join(bids_root, "sub-*", "beh", "sub-*_task-bct_beh.*")
+RAW_EAT = os.path.join(bids_root, "sub-*", "beh", "sub-*_task-eat_acq-*_beh.*")
+SURVEY = os.path.join(bids_root, "phenotype", "debriefing.*")
+STORE_BCT = os.path.join(bids_root, "derivatives", "parquet", "task-bct", "**", "*.parquet")
+STORE_EAT = os.path.join(bids_root, "derivatives", "parquet", "task-eat", "**", "*.parquet")
+
+BCT_RRATE_SUB = pandas_path("task-bct_agg-sub_rrate.tsv")
+BCT_RRATE = pandas_path("task-bct_rrate.tsv")
+EAT_CORRS_SUB = pandas_path("task-eat_acq-*_agg-sub_corrs.tsv")
+EAT_CORRS_TRIAL = pandas_path("task-eat_agg-trial_corrs.tsv")
+
+# Everything read by utils.load_all_data.
+ALL_DATA = [PARTICIPANTS, SURVEY, BCT_RRATE_SUB, BCT_RRATE, EAT_CORRS_SUB]
+
+
+def stage(script, *args, inputs=(), outputs=(), warm=True):
+    """A pipeline stage. Stages with warm=False always run in a fresh interpreter."""
+    name = " ".join((script,) + args)
+    return dict(name=name, script=script, args=list(args), warm=warm,
+        inputs=[code_path(script)] + COMMON_INPUTS + list(inputs), outputs=list(outputs))
+
+def survey_anova_stage(var):
+    task_id = "bct" if var in ["SMS", "attention"] else "eat"
+    plot_path = matplotlib_path(f"task-{task_id}_intrvX{var.lower()}.png")
+    return stage("survey-anova.py", "-v", var, inputs=ALL_DATA,
+        outputs=[plot_path, plot_path.replace(".png", "_slop.png"),
+            pingouin_path(f"task-{task_id}_intrvX{var.lower()}_anova.tsv"),
+            pingouin_path(f"task-{task_id}_intrvX{var.lower()}_pwise.tsv")])
+
+def eat_interaction_stage(source, metric):
+    basename = f"task-eat_acqXint_source-{source}_metric-{metric}"
+    return stage("eat-interaction.py", "-s", source, "-m", metric,
+        inputs=[PARTICIPANTS, EAT_CORRS_SUB, EAT_CORRS_TRIAL],
+        outputs=[matplotlib_path(f"{basename}.png"),
+            matplotlib_path(os.path.join("hires", f"{basename}.pdf")),
+            pingouin_path(f"{basename}_anova.tsv"),
+            pingouin_path(f"{basename}_pwise.tsv")])
+
+
+# In a valid run order (every stage comes after the stages it depends on).
+STAGES = [
+    stage("plot-predictions.py", "-w", "sleep",
+        outputs=[matplotlib_path("task-eat_prediction-sleep.png")]),
+    stage("plot-predictions.py", "-w", "learning",
+        outputs=[matplotlib_path("task-eat_prediction-learning.png")]),
+
+    stage("source2raw-bct.py", inputs=[SOURCE_BCT], outputs=[RAW_BCT, STORE_BCT], warm=False),
+    stage("source2raw-eat.py", inputs=[SOURCE_EAT], outputs=[RAW_EAT, STORE_EAT], warm=False),
+    stage("source2raw-survey.py", inputs=[SOURCE_SURVEY], outputs=[SURVEY], warm=False),
+
+    stage("eat-descr_correlations.py", inputs=[EAT_SCORING, RAW_EAT] + SEND_RATINGS,
+        outputs=[EAT_CORRS_SUB, EAT_CORRS_TRIAL,
+            pandas_path("task-eat_acq-*_agg-sub_corrs_descr.tsv")]),
+    stage("eat-descr_lags.py", inputs=[EAT_SCORING, RAW_EAT] + SEND_RATINGS,
+        outputs=[pandas_path("task-eat_agg-trial_lags.tsv"),
+            pandas_path("task-eat_acq-*_agg-sub_lags.tsv"),
+            pandas_path("task-eat_acq-*_agg-sub_lags_descr.tsv")]),
+    stage("eat-descr_windows.py", inputs=[EAT_SCORING, RAW_EAT] + SEND_RATINGS,
+        outputs=[pandas_path("task-eat_agg-window_corrs.tsv")]),
+    stage("eat-descr_surrogates.py", inputs=[EAT_SCORING, RAW_EAT] + SEND_RATINGS,
+        outputs=[pandas_path("task-eat_agg-trial_surrogates-shift.tsv")]),
+    stage("eat-merge_acqs.py", inputs=[EAT_CORRS_SUB],
+        outputs=[pandas_path("task-eat_agg-sub_corrs.tsv")]),
+    stage("eat-plot_timecourses.py", inputs=[PARTICIPANTS, RAW_EAT] + SEND_RATINGS,
+        outputs=[matplotlib_path("task-eat_timecourses.png")]),
+
+    stage("bct-descr_respirationrate.py", inputs=[RAW_BCT],
+        outputs=[BCT_RRATE_SUB, pandas_path("task-bct_agg-sub_rrate_descr.tsv")]),
+    stage("bct-plot_presses.py", inputs=[PARTICIPANTS, RAW_BCT],
+        outputs=[matplotlib_path("task-bct_presses.png"),
+            matplotlib_path(os.path.join("hires", "task-bct_presses.pdf"))]),
+    stage("bct-plot_respirationrate.py", inputs=[PARTICIPANTS, RAW_BCT],
+        outputs=[BCT_RRATE, matplotlib_path("task-bct_rrate.png"),
+            matplotlib_path("task-bct_rrate_desc.png")]),
+
+    stage("eat-strategy.py", inputs=ALL_DATA,
+        outputs=[matplotlib_path("task-eat_strategy.png")]),
+    stage("eat-joint.py", inputs=ALL_DATA,
+        outputs=[matplotlib_path("task-eat_intrvXattention.png")]),
+    eat_interaction_stage("actor", "mean"),
+    eat_interaction_stage("actor", "std"),
+    eat_interaction_stage("crowd", "mean"),
+    eat_interaction_stage("crowd", "std"),
+    stage("eat-outcomes.py", inputs=ALL_DATA,
+        outputs=[matplotlib_path("task-eat_intrvXoutcomes.png")]),
+
+    stage("bct-plot_respirationrate_joint.py", inputs=ALL_DATA,
+        outputs=[matplotlib_path("task-bct_rrate_desc_joint.png")]),
+    stage("bct-correlations.py", inputs=ALL_DATA,
+        outputs=[matplotlib_path("task-bct_correlations.png")]),
+    stage("bct-attention.py", inputs=ALL_DATA,
+        outputs=[matplotlib_path("task-bct_attention_detailed.png")]),
+
+    stage("meditation.py", inputs=ALL_DATA,
+        outputs=[matplotlib_path("meditation_prior.png")]),
+    stage("dreams.py", inputs=ALL_DATA,
+        outputs=[matplotlib_path("dreams.png")]),
+    stage("dreamsXempathy.py", inputs=ALL_DATA,
+        outputs=[matplotlib_path("dreamsXempathy.png"), pingouin_path("dreamsXempathy.tsv")]),
+    survey_anova_stage("SES"),
+    survey_anova_stage("SMS"),
+    survey_anova_stage("attention"),
+    survey_anova_stage("AS"),
+]
+
+
+def upstream_stages(stage_list):
+    """Map each stage name to the names of stages producing its inputs."""
+    producers = {}
+    for s in stage_list:
+        for pattern in s["outputs"]:
+            producers[pattern] = s["name"]
+    return { s["name"]: { producers[p] for p in s["inputs"] if p in producers } for s in stage_list }
+
+
+class HashCache:
+    """Content hashes of files, reused while a file's size and mtime are unchanged."""
+    def __init__(self, entries):
+        self.entries = entries
+
+    def file(self, path):
+        stat = os.stat(path)
+        key = f"{stat.st_size}:{stat.st_mtime_ns}"
+        entry = self.entries.get(path)
+        if entry is None or entry[0] != key:
+            entry = self.entries[path] = [key, utils.file_hash(path)]
+        return entry[1]
+
+    def pattern(self, pattern):
+        """Hash of every file matching a path or glob pattern."""
+        paths = sorted(p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p))
+        if not paths:
+            raise FileNotFoundError(f"No files match {pattern}")
+        return { p: self.file(p) for p in paths }
+
+
+def stage_signature(s, hashes):
+    inputs = { p: hashes.pattern(p) for p in s["inputs"] }
+    return hashlib.sha256(json.dumps([s["args"], inputs], sort_keys=True).encode()).hexdigest()
+
+def outputs_exist(s):
+    return all(glob.glob(p, recursive=True) for p in s["outputs"])
+
+
+def load_state():
+    if os.path.exists(state_filepath):
+        with open(state_filepath, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"stages": {}, "hashes": {}}
+
+def save_state(state):
+    utils.write_if_changed(state_filepath, json.dumps(state, indent=1, sort_keys=True))
+
+
+def missing_sources(stage_list):
+    """Inputs that no stage produces and that match no file, as (stage name, pattern)."""
+    produced = { p for s in STAGES for p in s["outputs"] }
+    return [ (s["name"], p) for s in stage_list for p in s["inputs"]
+        if p not in produced and not glob.glob(p, recursive=True) ]
+
+
+def select_stages(patterns):
+    """Stages matching any of the name patterns, plus everything upstream of them."""
+    if not patterns:
+        return STAGES
+    parents = upstream_stages(STAGES)
+    wanted = { s["name"] for s in STAGES if any(fnmatch.fnmatch(s["name"], p) for p in patterns) }
+    if not wanted:
+        raise ValueError(f"No stages match {patterns}")
+    stack = list(wanted)
+    while stack:
+        for parent in parents[stack.pop()]:
+            if parent not in wanted:
+                wanted.add(parent)
+                stack.append(parent)
+    return [ s for s in STAGES if s["name"] in wanted ]
+
+
+def log_path(s):
+    basename = s["name"].replace(".py", "").replace(" ", "_") + ".log"
+    return os.path.join(log_dir, basename)
+
+def run_stage(s, warm=False):
+    """Run one stage, writing its stdout and stderr to the stage log.
+
+    Stages run as a subprocess, or with warm=True as __main__ inside
+    this (already warmed up) worker process.
+    """
+    utils.make_pathdir_if_not_exists(log_path(s))
+    t0 = time.perf_counter()
+    with open(log_path(s), "w", encoding="utf-8") as log:
+        if warm and s["warm"]:
+            returncode = run_script_in_process(s["script"], s["args"], log)
+        else:
+            command = [sys.executable, code_path(s["script"])] + s["args"]
+            returncode = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, cwd=code_dir).returncode
+    return returncode, time.perf_counter() - t0
+
+
+def warm_up():
+    """Pool initializer for --warm. Import the scientific stack once per worker
+    and let utils share loaded frames between the scripts it runs.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import colorcet
+    import matplotlib.pyplot
+    import numpy
+    import pandas
+    import pingouin
+    import scipy.stats
+    import seaborn
+    os.chdir(code_dir) # as for the subprocess stages
+    utils.enable_frame_cache()
+
+def run_script_in_process(script, script_args, log):
+    import contextlib
+    import runpy
+    import traceback
+    import matplotlib
+    import matplotlib.pyplot as plt
+    # Scripts change rcParams freely, so start each one from the defaults.
+    matplotlib.rcdefaults()
+    argv = sys.argv
+    sys.argv = [script] + script_args
+    try:
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            try:
+                runpy.run_path(code_path(script), run_name="__main__")
+                returncode = 0
+            except SystemExit as e:
+                returncode = e.code if isinstance(e.code, int) else int(e.code is not None)
+            except Exception:
+                traceback.print_exc()
+                returncode = 1
+    finally:
+        sys.argv = argv
+        plt.close("all")
+    return returncode
+
+
+def is_stale(s, state, hashes, forced):
+    return (s["name"] in forced or not outputs_exist(s)
+        or state["stages"].get(s["name"]) != stage_signature(s, hashes))
+
+
+def dry_run(selected, parents, state, hashes, forced):
+    stale = set()
+    for s in selected:
+        if parents[s["name"]] & stale or is_stale(s, state, hashes, forced):
+            stale.add(s["name"])
+        print("stale     " if s["name"] in stale else "up to date", s["name"])
+
+
+def run_pipeline(selected, parents, state, hashes, forced, n_jobs, warm=False):
+    """Run stale stages on a process pool as soon as everything upstream is finished.
+
+    Staleness is checked when a stage becomes ready, so a rebuilt
+    upstream stage whose outputs did not change does not trigger
+    its downstream stages.
+    """
+    selected_names = { s["name"] for s in selected }
+    waiting = list(selected)
+    finished = set()
+    running = {}
+    failed = []
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=warm_up if warm else None) as pool:
+        while waiting or running:
+            ready = True
+            while ready and not failed:
+                ready = False
+                for s in list(waiting):
+                    if parents[s["name"]] & selected_names - finished:
+                        continue
+                    waiting.remove(s)
+                    if is_stale(s, state, hashes, forced):
+                        print(f"==> {s['name']}", flush=True)
+                        running[pool.submit(run_stage, s, warm)] = s
+                    else:
+                        finished.add(s["name"])
+                        ready = True
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                s = running.pop(future)
+                returncode, elapsed = future.result()
+                if returncode != 0:
+                    failed.append(s["name"])
+                    print(f"!!! {s['name']} failed with exit code {returncode} (see {log_path(s)})", flush=True)
+                    continue
+                # Record the inputs as they were used, so an unchanged rebuild
+                # upstream does not mark this stage stale next time.
+                state["stages"][s["name"]] = stage_signature(s, hashes)
+                finished.add(s["name"])
+                print(f"    {s['name']} finished in {elapsed:.1f} s", flush=True)
+    return failed
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Rebuild out-of-date analysis stages.")
+    parser.add_argument("stages", nargs="*", help="Stage name patterns (e.g., 'eat-*'). Default is all stages.")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="List stale stages without running them.")
+    parser.add_argument("-f", "--force", action="store_true", help="Rerun the selected stages even if up to date.")
+    parser.add_argument("-l", "--list", action="store_true", help="List all stages and their dependencies.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of stages to run at once.")
+    parser.add_argument("-w", "--warm", action="store_true", help="Run analysis scripts inside long-lived worker processes.")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, parents in upstream_stages(STAGES).items():
+            print(name, "<-", ", ".join(sorted(parents)) if parents else "(sources)")
+        sys.exit(0)
+
+    assert args.jobs >= 1, "Need at least 1 job."
+
+    state = load_state()
+    hashes = HashCache(state["hashes"])
+    parents = upstream_stages(STAGES)
+    selected = select_stages(args.stages)
+    forced = set()
+    if args.force:
+        forced = { s["name"] for s in STAGES
+            if not args.stages or any(fnmatch.fnmatch(s["name"], p) for p in args.stages) }
+
+    missing = missing_sources(selected)
+    if missing:
+        sys.exit("Inputs matching no files:\n" + "\n".join(f"  {name}: {p}" for name, p in missing))
+
+    if args.dry_run:
+        dry_run(selected, parents, state, hashes, forced)
+        sys.exit(0)
+
+    try:
+        failed = run_pipeline(selected, parents, state, hashes, forced, args.jobs, args.warm)
+    finally:
+        save_state(state)
+    if failed:
+        sys.exit(f"Failed stages: {', '.join(failed)}")
@@ -1,6 +1,7 @@
 """Clean the BCT task data.
 Go from raw json psychopy output to usable dataframe in BIDS format.
 """
+import argparse
 import os
 import json
 import pandas as pd
@@ -89,27 +90,11 @@ target = 9
 target_response = "right"
 nontarget_response = "left"
 reset_response = "space"
-def press_accuracy(row):
-    """Works as cycle accuracy too if take last row of each cycle.
-    """
-    if row["response"] == reset_response:
-        return "selfcaught"
-    elif row["response"] == target_response and row["press"] == target:
-        return "correct"
-    elif row["press"] > target:
-        return "overshoot"
-    elif row["press"] == target and row["response"] == nontarget_response:
-        return "overshoot"
-    elif row["press"] < target and row["response"] == nontarget_response:
-        return "correct"
-    elif row["press"] < target and row["response"] == target_response:
-        return "undershoot"
-    else:
-        raise ValueError("Should never get here")
-
-file_list = utils.find_source_files("bct", "json")
-
-for file in file_list:
+
+bids_root = utils.load_config().bids_root
+
+def convert_file(file):
+    """Convert one participant's source file. Returns the files written."""
     with open(file, "r", encoding="utf-8") as f:
         subject_data = json.load(f)
     # convert cycle number strings to integers
@@ -122,11 +107,29 @@ for file in file_list:
     # cycle_list = [ v for v in  ]
     rows = [ [i+1, j+1] + resp for i, cycle in enumerate(subject_data.values()) for j, resp in enumerate(cycle) ]
     df = pd.DataFrame(rows, columns=column_names)
-    df["response_time"] = df["response_time"].diff().fillna(df["response_time"][0]).mul(1000)
-    df["press_accuracy"] = df.apply(press_accuracy, axis=1)
+    # Round to whole milliseconds, as exported, so the Parquet store matches the TSV.
+    df["response_time"] = df["response_time"].diff().fillna(df["response_time"][0]).mul(1000).round()
+    df["press_accuracy"] = utils.score_bct_presses(df["press"], df["response"], target=target,
+        target_response=target_response, nontarget_response=nontarget_response, reset_response=reset_response)
     sub, ses, task = utils.filename2labels(file)
     basename = os.path.basename(file).replace(".json", "_beh.tsv").replace("_ses-001", "")
-    data_filepath = os.path.join(utils.load_config().bids_root, sub, "beh", basename)
-    utils.make_pathdir_if_not_exists(data_filepath)
-    df.to_csv(data_filepath, index=False, sep="\t", float_format="%.0f")
-    utils.pretty_sidecar_export(sidecar, data_filepath)
\ No newline at end of file
+    data_filepath = os.path.join(bids_root, sub, "beh", basename)
+    utils.write_if_changed(data_filepath, df.to_csv(index=False, sep="\t", float_format="%.0f"))
+    sidecar_filepath = utils.pretty_sidecar_export(sidecar, data_filepath)
+    store_filepaths = utils.export_task_partition(df, data_filepath, "bct")
+    return [data_filepath, sidecar_filepath] + store_filepaths
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of files to convert at once.")
+    args = parser.parse_args()
+
+    file_list = utils.find_source_files("bct", "json")
+
+    # Only convert sessions that are new or changed since the last run.
+    manifest = utils.ConversionManifest("source2raw-bct", [__file__])
+    file_list = [ f for f in file_list if not manifest.is_current(f) ]
+
+    utils.run_conversions(convert_file, file_list, manifest, n_jobs=args.jobs)
@@ -1,6 +1,7 @@
+import argparse
 import os
 import json
-from itertools import repeat
+import numpy as np
 import pandas as pd
 
 import utils
@@ -42,24 +43,46 @@ column_names = list(column_metadata.keys())
 
 sidecar = task_metadata | global_metadata | column_metadata
 
-file_list = utils.find_source_files("eat", "json")
-
+bids_root = utils.load_config().bids_root
 
 # path_basename = "target_112_3_normal.csv"
-for file in file_list:
+def convert_file(file):
+    """Convert one participant's source file. Returns the files written."""
     with open(file, "r", encoding="utf-8") as f:
         subject_data = json.load(f)
     # remove practice trial
     subject_data = { k: v for k, v in subject_data.items() if k != practice_video_id }
-    # wrangle
-    trials = [ [repeat(i+1, len(v)), repeat(k, len(v)),
-                [ sample_rate_s*j for j in range(len(v)) ], v]
-        for i, (k, v) in enumerate(subject_data.items()) ]
-    df = pd.concat([ pd.DataFrame(t).T for t in trials ])
+    # wrangle: one row per sample, built from whole-session arrays
+    lengths = np.array([ len(v) for v in subject_data.values() ], dtype=int)
+    trial_starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    df = pd.DataFrame({
+        "trial_number": np.repeat(np.arange(1, len(lengths)+1), lengths),
+        "stimulus": np.repeat(np.array(list(subject_data), dtype=object), lengths),
+        "time": (np.arange(lengths.sum()) - trial_starts) * sample_rate_s,
+        "response": np.concatenate([ np.asarray(v, dtype=float) for v in subject_data.values() ]
+            + [np.empty(0)]),
+    }, columns=column_names)
     sub, ses, task = utils.filename2labels(file)
     basename = os.path.basename(file).replace(".json", "_beh.tsv").replace("_ses-001", ""
         ).replace("-eatA", "-eat_acq-pre").replace("-eatB", "-eat_acq-post")
-    data_filepath = os.path.join(utils.load_config().bids_root, sub, "beh", basename)
-    utils.make_pathdir_if_not_exists(data_filepath)
-    df.to_csv(data_filepath, header=column_names, index=False, sep="\t", float_format="%.0f")
-    utils.pretty_sidecar_export(sidecar, data_filepath)
\ No newline at end of file
+    data_filepath = os.path.join(bids_root, sub, "beh", basename)
+    utils.write_if_changed(data_filepath,
+        df.to_csv(index=False, sep="\t"))
+    sidecar_filepath = utils.pretty_sidecar_export(sidecar, data_filepath)
+    store_filepaths = utils.export_task_partition(df, data_filepath, "eat")
+    return [data_filepath, sidecar_filepath] + store_filepaths
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of files to convert at once.")
+    args = parser.parse_args()
+
+    file_list = utils.find_source_files("eat", "json")
+
+    # Only convert sessions that are new or changed since the last run.
+    manifest = utils.ConversionManifest("source2raw-eat", [__file__])
+    file_list = [ f for f in file_list if not manifest.is_current(f) ]
+
+    utils.run_conversions(convert_file, file_list, manifest, n_jobs=args.jobs)
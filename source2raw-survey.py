@@ -1,15 +1,26 @@
+import glob
+import json
 import os
+import sys
+from types import SimpleNamespace
 import numpy as np
 import pandas as pd
 import pyreadstat
 import utils
 
 bids_root = utils.load_config().bids_root
-# import_filepath = os.path.join(bids_root, "sourcedata", "qualtrics.sav")
-import_filepath = os.path.join(bids_root, "sourcedata", "PEACE+empathy+post-study_August+14,+2022_13.52.sav")
+# Every Qualtrics export in sourcedata, oldest first. Later exports repeat
+# the earlier responses, which are merged in only once (see below).
+import_filepaths = sorted(glob.glob(os.path.join(bids_root, "sourcedata", "*.sav")), key=os.path.getmtime)
+assert import_filepaths, "No Qualtrics .sav exports in sourcedata."
 export_filepath = os.path.join(bids_root, "phenotype", "debriefing.tsv")
 utils.make_pathdir_if_not_exists(export_filepath)
 
+# Nothing to do if the exports (and this code) haven't changed since the last run.
+manifest = utils.ConversionManifest("source2raw-survey", [__file__])
+if all(map(manifest.is_current, import_filepaths)):
+    sys.exit()
+
 
 ## Start the sidecar with general info but extract the column info from file metadata.
 sidecar = {
@@ -20,27 +31,87 @@ sidecar = {
 }
 
 
-# Load all data and metadata.
-df, meta = pyreadstat.read_sav(import_filepath)
-
-# Remove development trials
-df = df[df["participant_ID"].lt(900)]
-
-
-###########
-########### Make sure default Quatrics stuff looks normal and then remove it.
-###########
-# assert len(df) == 4, "Only 4 raters should be there."
-assert df["Finished"].all(), "Everyone should have finished."
-assert df["DistributionChannel"].eq("anonymous").all(), "All responses should come through the anonymous survey link."
-assert df["ResponseId"].is_unique, "These should all be unique."
-assert df["UserLanguage"].eq("EN").all(), "All languages should be English."
 QUALTRICS_COLUMNS = ["IPAddress", "RecipientLastName", "RecipientFirstName",
     "RecipientEmail", "ExternalReference", "ResponseId", "UserLanguage",
     "DistributionChannel", "StartDate", "EndDate", "RecordedDate",
     "Status", "Progress", "Finished", "LocationLatitude", "LocationLongitude",
     "Duration__in_seconds_"]
-df = df.drop(columns=QUALTRICS_COLUMNS)
+# Qualtrics columns that are only loaded to be checked below.
+CHECKED_QUALTRICS_COLUMNS = ["Finished", "DistributionChannel", "ResponseId", "UserLanguage"]
+
+def read_survey(filepath):
+    """Parse a .sav export, skipping the Qualtrics columns that get dropped anyway.
+    Returns the data and the metadata needed for the sidecar, with value labels
+    as [value, label] pairs so they survive the JSON state file in order.
+    """
+    _, meta = pyreadstat.read_sav(filepath, metadataonly=True)
+    usecols = [ c for c in meta.column_names
+        if c not in QUALTRICS_COLUMNS or c in CHECKED_QUALTRICS_COLUMNS ]
+    df, meta = pyreadstat.read_sav(filepath, usecols=usecols)
+    metadata = {
+        "column_names_to_labels": meta.column_names_to_labels,
+        "variable_value_labels": { k: list(v.items()) for k, v in meta.variable_value_labels.items() },
+    }
+    return df, metadata
+
+
+# Responses merged so far, and which exports they came from. Kept across runs
+# so each export is parsed once and each response is checked once. Any change
+# to this script (eg, to the filtering or checks) starts the merge over.
+state_path = os.path.join(utils.cache_dir(), "survey_state.json")
+responses_path = os.path.join(utils.cache_dir(), "survey_responses.parquet")
+read_columns = [QUALTRICS_COLUMNS, CHECKED_QUALTRICS_COLUMNS]
+code_hash = utils.file_hash(__file__)
+state = {"read_columns": read_columns, "code": code_hash, "exports": {}, "metadata": None}
+responses = None
+if os.path.exists(state_path) and os.path.exists(responses_path):
+    with open(state_path, "r", encoding="utf-8") as f:
+        saved_state = json.load(f)
+    if saved_state.get("read_columns") == read_columns and saved_state.get("code") == code_hash:
+        state = saved_state
+        responses = pd.read_parquet(responses_path)
+
+for import_filepath in import_filepaths:
+    source_hash = manifest.source_hash(import_filepath)
+    if state["exports"].get(import_filepath) == source_hash:
+        continue
+    new_df, state["metadata"] = read_survey(import_filepath)
+    if responses is not None:
+        new_df = new_df[~new_df["ResponseId"].isin(responses["ResponseId"])]
+
+    # Remove development trials
+    new_df = new_df[new_df["participant_ID"].lt(900)]
+
+    ###########
+    ########### Make sure default Quatrics stuff looks normal for the new responses.
+    ###########
+    # assert len(df) == 4, "Only 4 raters should be there."
+    assert new_df["Finished"].all(), "Everyone should have finished."
+    assert new_df["DistributionChannel"].eq("anonymous").all(), "All responses should come through the anonymous survey link."
+    assert new_df["ResponseId"].is_unique, "These should all be unique."
+    assert new_df["UserLanguage"].eq("EN").all(), "All languages should be English."
+
+    responses = new_df if responses is None else pd.concat([responses, new_df], ignore_index=True)
+    state["exports"][import_filepath] = source_hash
+
+# Write then rename, responses first: if interrupted in between, the old state just
+# makes the next run re-read the newest exports, whose responses are then skipped.
+utils.make_pathdir_if_not_exists(responses_path)
+tmp_path = f"{responses_path}.{os.getpid()}.tmp"
+try:
+    responses.to_parquet(tmp_path, index=False)
+except ImportError: # no pyarrow, so the next run merges all exports again
+    pass
+else:
+    os.replace(tmp_path, responses_path)
+    utils.write_if_changed(state_path, json.dumps(state))
+
+meta = SimpleNamespace(
+    column_names_to_labels=state["metadata"]["column_names_to_labels"],
+    variable_value_labels={ k: dict(v) for k, v in state["metadata"]["variable_value_labels"].items() },
+)
+# Then remove the Qualtrics stuff.
+df = responses.drop(columns=CHECKED_QUALTRICS_COLUMNS)
 
 # df["task_condition"] = df["participant_ID"].map(lambda x: "svp" if x%2==0 else "bct")
 
@@ -97,44 +168,63 @@ for column_name in df:
 # df.loc[df["Meditation_Prior"].eq(1), ["Meditation_Freq_1", "Meditation_Current"]] = 0
 # df.loc[df["Meditation_Current"].eq(1), ["Meditation_Freq2", "Meditation_Freq3"]] = 0
 
-def imputed_mean(row):
-    if row.isna().mean() > .5:
-        # Return nan if more than half of responses are missing.
-        return np.nan
-    else:
-        return row.fillna(row.mean()).mean()
-
-# Score State Empathy Scale
-AFFECTIVE_PROBES = [1, 2, 3, 4]
-COGNITIVE_PROBES = [5, 6, 7, 8]
-ASSOCIATIVE_PROBES = [9, 10, 11, 12]
-affective_columns = [ f"SES_{x}" for x in AFFECTIVE_PROBES ]
-cognitive_columns = [ f"SES_{x}" for x in COGNITIVE_PROBES ]
-associative_columns = [ f"SES_{x}" for x in ASSOCIATIVE_PROBES ]
-# df["state_affective_empathy"] = df[affective_columns].sub(1).mean(axis=1, skipna=True)
-# df["state_cognitive_empathy"] = df[cognitive_columns].sub(1).mean(axis=1, skipna=True)
-# df["state_associative_empathy"] = df[associative_columns].sub(1).mean(axis=1, skipna=True)
-df["SES_affective"] = df[affective_columns].sub(1).apply(imputed_mean, axis=1)
-df["SES_cognitive"] = df[cognitive_columns].sub(1).apply(imputed_mean, axis=1)
-df["SES_associative"] = df[associative_columns].sub(1).apply(imputed_mean, axis=1)
-
-df = df.drop(columns=affective_columns+cognitive_columns+associative_columns)
-
-
-# Score State Mindfulness Scale
-MIND_PROBES = [1, 2, 3, 4, 5, 6, 7, 10, 11, 12, 15, 16, 17, 19, 20]
-BODY_PROBES = [8, 9, 13, 14, 18, 21]
-mind_columns = [ f"SMS_{x}" for x in MIND_PROBES ]
-body_columns = [ f"SMS_{x}" for x in BODY_PROBES ]
-df["SMS_mind"] = df[mind_columns].apply(imputed_mean, axis=1)
-df["SMS_body"] = df[body_columns].apply(imputed_mean, axis=1)
-
-df = df.drop(columns=mind_columns+body_columns)
+def score_scales(df, scales):
+    """Score questionnaire subscales as item means, all in one pass.
+
+    scales maps each score column to a definition like the survey_scales
+    entries in config.json:
+        items         item columns of the subscale
+        reverse_items items scored as (min + max) - response, using scale_range
+        scale_range   [min, max] of the response scale (needed for reverse_items)
+        offset        added to every item, eg -1 to start a 1-7 scale at 0
+        max_missing   score is NaN if more than this fraction of items is missing
+                      (default 0.5), otherwise missing items are mean-imputed,
+                      which is just the mean of the answered items.
+    Returns a DataFrame of scores with the same index as df.
+    """
+    items = list(dict.fromkeys(item for scale in scales.values() for item in scale["items"]))
+    responses = df[items].to_numpy(dtype=float)
+    answered = ~np.isnan(responses)
+    responses = np.where(answered, responses, 0)
+    # item-by-scale membership, split into forward and reverse-keyed items
+    forward = np.zeros((len(items), len(scales)))
+    reverse = np.zeros((len(items), len(scales)))
+    reverse_constant = np.zeros(len(scales))
+    offsets = np.zeros(len(scales))
+    max_missing = np.zeros(len(scales))
+    for j, scale in enumerate(scales.values()):
+        reverse_items = set(scale.get("reverse_items", []))
+        for item in scale["items"]:
+            membership = reverse if item in reverse_items else forward
+            membership[items.index(item), j] = 1
+        if reverse_items:
+            low, high = scale["scale_range"]
+            reverse_constant[j] = low + high
+        offsets[j] = scale.get("offset", 0)
+        max_missing[j] = scale.get("max_missing", .5)
+    n_answered = answered @ (forward + reverse)
+    totals = responses @ forward + (answered @ reverse) * reverse_constant - responses @ reverse
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = totals / n_answered + offsets
+    missing = 1 - n_answered / (forward + reverse).sum(axis=0)
+    scores[missing > max_missing] = np.nan
+    return pd.DataFrame(scores, index=df.index, columns=list(scales))
+
+
+# Score the State Empathy and State Mindfulness subscales (see survey_scales in config.json)
+# and replace their items with the scores.
+scales = utils.load_config(as_object=False)["survey_scales"]
+scored_items = list(dict.fromkeys(item for scale in scales.values() for item in scale["items"]))
+df = df.drop(columns=scored_items).join(score_scales(df, scales))
 
 df = df.rename(columns={"participant_ID": "participant_id"})
 df["participant_id"] = df["participant_id"].astype(int)
 # df["participant_id"] = df["participant_id"].map(lambda x: f"sub-{x:03d}")
 
 
-df.to_csv(export_filepath, sep="\t", index=False, na_rep="NA", float_format="%.2f")
-utils.pretty_sidecar_export(sidecar, export_filepath)
\ No newline at end of file
+utils.write_if_changed(export_filepath,
+    df.to_csv(sep="\t", index=False, na_rep="NA", float_format="%.2f"))
+sidecar_filepath = utils.pretty_sidecar_export(sidecar, export_filepath)
+for import_filepath in import_filepaths:
+    manifest.record(import_filepath, [export_filepath, sidecar_filepath])
+manifest.save()
\ No newline at end of file
@@ -1,54 +1,284 @@
+# Parsed config.json, shared by every load_config call until the file changes.
+_config_cache = {}
+
 def load_config(as_object=True):
+    """Load config.json as a namespace (default) or a dict.
+    The file is parsed once and re-read only when its mtime changes,
+    so the returned objects are shared and should be treated as read-only.
+    bids_root is resolved to an absolute path relative to config.json,
+    so it does not depend on the working directory.
+    """
     import json
+    import os
     from types import SimpleNamespace
-    with open("./config.json", "r", encoding="utf-8") as jsonfile:
-        if as_object:
-            config = json.load(jsonfile, object_hook=lambda d: SimpleNamespace(**d))
-            # # Extract the condition mapping from configuration namespace.
-            # # Needs to be a dictionary, with ints as keys (not strings).
-            # condmap_as_dict = { int(k): v for k, v in vars(config.condition_mapping).items() }
-            # config.condition_mapping = condmap_as_dict
-        else:
+    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+    mtime = os.stat(config_path).st_mtime_ns
+    if _config_cache.get("mtime") != mtime:
+        with open(config_path, "r", encoding="utf-8") as jsonfile:
             config = json.load(jsonfile)
-    return config
+        config["bids_root"] = os.path.normpath(
+            os.path.join(os.path.dirname(config_path), config["bids_root"]))
+        def to_namespace(obj):
+            if isinstance(obj, dict):
+                return SimpleNamespace(**{ k: to_namespace(v) for k, v in obj.items() })
+            elif isinstance(obj, list):
+                return [ to_namespace(x) for x in obj ]
+            return obj
+        _config_cache.update(mtime=mtime, dict=config, object=to_namespace(config))
+    return _config_cache["object"] if as_object else _config_cache["dict"]
 
 def load_participant_file():
     import os
     import pandas as pd
     config = load_config(as_object=False)
-    path = os.path.join(load_config().bids_root, "participants.tsv")
+    path = os.path.join(config["bids_root"], "participants.tsv")
     df = pd.read_csv(path, sep="\t", index_col="participant_id")
     df["included"] = df.index.map(lambda x: x not in config["participant_exclusions"])
     return df
 
-def find_source_files(task_label, extension):
+def parse_bids_filename(filename):
+    """Split a BIDS filename into its entities, suffix, and extension.
+    eg, "sub-001_task-eat_acq-pre_beh.tsv" -> {"sub": "001", "task": "eat",
+        "acq": "pre", "suffix": "beh", "extension": ".tsv"}
+    Filenames without a suffix (eg, sourcedata) get suffix None.
+    """
+    import os
+    basename = os.path.basename(filename)
+    stem, dot, extension = basename.partition(".")
+    parts = stem.split("_")
+    entities = {"suffix": None, "extension": dot + extension}
+    if "-" not in parts[-1]:
+        entities["suffix"] = parts.pop()
+    for part in parts:
+        key, _, value = part.partition("-")
+        entities[key] = value
+    return entities
+
+
+# Directory listings under the BIDS root, as {directory: [mtime_ns, files, subdirectories]},
+# plus the files indexed by (scope, task, suffix, extension). Persisted in derivatives/cache.
+_layout = {"dirs": {}, "index": None}
+
+def _layout_path():
+    import os
+    return os.path.join(cache_dir(), "layout.json")
+
+def _scan_layout_dir(path, old_dirs, new_dirs, subdir_filter=None):
+    """Record path's listing, re-reading it only if its mtime changed, then recurse."""
+    import os
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return
+    entry = old_dirs.get(path)
+    if entry is None or entry[0] != mtime:
+        files, subdirs = [], []
+        with os.scandir(path) as it:
+            for e in it:
+                (subdirs if e.is_dir() else files).append(e.name)
+        entry = [mtime, sorted(files), sorted(subdirs)]
+    new_dirs[path] = entry
+    for name in entry[2]:
+        if subdir_filter is None or subdir_filter(name):
+            _scan_layout_dir(os.path.join(path, name), old_dirs, new_dirs)
+
+def refresh_layout():
+    """Bring the layout index up to date with the raw participant
+    directories and sourcedata, re-listing only directories that changed.
+    """
+    import json
     import os
-    walk_dir = os.path.join(load_config().bids_root, "sourcedata")
-    file_list = []
-    for root, dirs, files in os.walk(walk_dir):
+    bids_root = load_config().bids_root
+    if not _layout["dirs"] and os.path.exists(_layout_path()):
+        with open(_layout_path(), "r", encoding="utf-8") as f:
+            _layout["dirs"] = json.load(f)
+    old_dirs = _layout["dirs"]
+    new_dirs = {}
+    # Only the raw participant folders and sourcedata (not derivatives, stimuli, code, etc.).
+    _scan_layout_dir(bids_root, old_dirs, new_dirs,
+        subdir_filter=lambda name: name.startswith("sub-") or name == "sourcedata")
+    if new_dirs == old_dirs and _layout["index"] is not None:
+        return
+    sourcedata_dir = os.path.join(bids_root, "sourcedata")
+    index = {}
+    for directory, (_, files, _) in new_dirs.items():
+        scope = "sourcedata" if directory == sourcedata_dir or directory.startswith(sourcedata_dir + os.sep) else "raw"
         for name in files:
-            if name.endswith(extension) and f"task-{task_label}" in name:
-                full_path = os.path.join(root, name)
-                file_list.append(full_path)
-    return sorted(file_list)
+            entities = parse_bids_filename(name)
+            key = (scope, entities.get("task"), entities["suffix"], entities["extension"])
+            index.setdefault(key, []).append((os.path.join(directory, name), entities))
+    _layout.update(dirs=new_dirs, index=index)
+    if new_dirs != old_dirs:
+        make_pathdir_if_not_exists(_layout_path())
+        tmp_path = f"{_layout_path()}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(new_dirs, f)
+        os.replace(tmp_path, _layout_path())
 
+def find_bids_files(scope="raw", task=None, suffix=None, extension=None, task_prefix=False, **entities):
+    """Query the layout index, eg find_bids_files(task="eat", suffix="beh", extension=".tsv").
+    scope is "raw" (participant folders) or "sourcedata". With task_prefix,
+    task matches any task label starting with it (eg, "eat" matches "eatA").
+    Other keyword arguments filter on entities (eg, sub="001", acq="pre").
+    Returns a sorted list of paths.
+    """
+    refresh_layout()
+    if task_prefix:
+        keys = [ k for k in _layout["index"] if k[0] == scope and (k[1] or "").startswith(task)
+            and (suffix is None or k[2] == suffix) and (extension is None or k[3] == extension) ]
+    elif suffix is None or extension is None:
+        keys = [ k for k in _layout["index"] if k[:2] == (scope, task)
+            and (suffix is None or k[2] == suffix) and (extension is None or k[3] == extension) ]
+    else:
+        keys = [(scope, task, suffix, extension)]
+    matches = []
+    for key in keys:
+        for path, path_entities in _layout["index"].get(key, []):
+            if all(path_entities.get(k) == v for k, v in entities.items()):
+                matches.append(path)
+    return sorted(matches)
 
-def load_all_data(exclude=False):
-    """Load and merge survey data, BCT score, EAT scores
-    so each participant is 1 row.
+def find_source_files(task_label, extension):
+    extension = extension if extension.startswith(".") else f".{extension}"
+    return find_bids_files("sourcedata", task=task_label, extension=extension, task_prefix=True)
+
+
+# Frames shared between scripts that run in one interpreter (runall.py --warm).
+# Left off for ordinary one-off script runs, which would only pay for the copies.
+_frame_cache = None
+
+def enable_frame_cache():
+    global _frame_cache
+    if _frame_cache is None:
+        _frame_cache = {}
+
+def cached_frames(key, filepaths, loader):
+    """Return loader(), reusing an earlier result while none of filepaths have changed.
+    Results are deep-copied on the way out so callers can modify them freely.
+    """
+    import copy
+    import os
+    if _frame_cache is None:
+        return loader()
+    stamps = [ (p, os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in filepaths ]
+    if key not in _frame_cache or _frame_cache[key][0] != stamps:
+        _frame_cache[key] = (stamps, loader())
+    return copy.deepcopy(_frame_cache[key][1])
+
+
+def cache_dir():
+    import os
+    return os.path.join(load_config().bids_root, "derivatives", "cache")
+
+def cached_snapshot(name, key_parts, builder, columns=None):
+    """Return builder()'s (dataframe, metadata) pair through an on-disk Parquet snapshot.
+
+    The snapshot is keyed on a hash of key_parts (e.g., input file hashes),
+    and rebuilt (replacing older snapshots of the same name) whenever that
+    changes. With columns, only those columns are read back. Files are
+    written then renamed, so concurrent processes never read a partial
+    snapshot, and an unreadable one is just rebuilt.
+    Without pyarrow, builder() is called every time.
     """
+    import glob
+    import hashlib
     import json
     import os
     import pandas as pd
+    key = hashlib.sha256(json.dumps(key_parts, sort_keys=True).encode()).hexdigest()[:16]
+    snapshot_path = os.path.join(cache_dir(), f"{name}_{key}.parquet")
+    metadata_path = snapshot_path.replace(".parquet", ".json")
+    use_pyarrow = _has_pyarrow()
+    if use_pyarrow:
+        try:
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+            return pd.read_parquet(snapshot_path, columns=columns), metadata
+        except (OSError, ValueError): # missing, partial, or removed meanwhile
+            pass
+    df, metadata = builder()
+    if use_pyarrow:
+        for old_path in glob.glob(os.path.join(cache_dir(), f"{name}_*.parquet")) + \
+                glob.glob(os.path.join(cache_dir(), f"{name}_*.json")):
+            if old_path not in [snapshot_path, metadata_path]:
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError: # another process got there first
+                    pass
+        make_pathdir_if_not_exists(snapshot_path)
+        tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+        try:
+            df.to_parquet(tmp_path, index=True)
+        except (ValueError, TypeError): # columns pyarrow can't store, just skip the snapshot
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        else:
+            # Metadata first, so whenever the parquet is there its metadata is too.
+            tmp_metadata_path = f"{metadata_path}.{os.getpid()}.tmp"
+            with open(tmp_metadata_path, "w", encoding="utf-8") as f:
+                json.dump(metadata, f)
+            os.replace(tmp_metadata_path, metadata_path)
+            os.replace(tmp_path, snapshot_path)
+    if columns is not None:
+        df = df[columns]
+    return df, metadata
+
+
+def load_all_data(exclude=False, columns=None):
+    """Load and merge survey data, BCT score, EAT scores
+    so each participant is 1 row.
+
+    The merged frame is snapshotted in derivatives/cache, keyed on the
+    contents of its input files and on the merging code, so repeat calls
+    skip the reading and merging.
+    Pass columns to load only those columns from the snapshot.
+    """
+    import hashlib
+    import inspect
+    import os
 
-    root_dir = load_config().bids_root
+    config = load_config(as_object=False)
+    root_dir = config["bids_root"]
+    participants_path = os.path.join(root_dir, "participants.tsv")
     survey_path = os.path.join(root_dir, "phenotype", "debriefing.tsv")
     bct_path = os.path.join(root_dir, "derivatives", "pandas", "task-bct_agg-sub_rrate.tsv")
     bct2_path = os.path.join(root_dir, "derivatives", "pandas", "task-bct_rrate.tsv")
     eat_pre_path = os.path.join(root_dir, "derivatives", "pandas", "task-eat_acq-pre_agg-sub_corrs.tsv")
     eat_post_path = os.path.join(root_dir, "derivatives", "pandas", "task-eat_acq-post_agg-sub_corrs.tsv")
-
     sidecar_path = survey_path.replace(".tsv", ".json")
+
+    input_paths = [participants_path, survey_path, sidecar_path,
+        bct_path, bct2_path, eat_pre_path, eat_post_path]
+
+    read_columns = None
+    if columns is not None:
+        read_columns = list(columns)
+        if exclude and "included" not in read_columns:
+            read_columns.append("included")
+
+    def loader():
+        # Exclusions are applied in load_participant_file, so they are part of the key too,
+        # as is the code of the functions building the frame (but not the rest of utils).
+        merge_code = "".join(map(inspect.getsource, [load_participant_file, _merge_all_data]))
+        key_parts = [ file_hash(p) for p in input_paths ] + [config["participant_exclusions"],
+            hashlib.sha256(merge_code.encode()).hexdigest()]
+        merger = lambda: _merge_all_data(survey_path, sidecar_path, bct_path, bct2_path, eat_pre_path, eat_post_path)
+        return cached_snapshot("all_data", key_parts, merger, columns=read_columns)
+
+    key = ("all_data", None if read_columns is None else tuple(read_columns))
+    df, survey_sidecar = cached_frames(key, input_paths, loader)
+
+    if exclude:
+        df = df[df["included"]].reset_index(drop=True)
+    if columns is not None:
+        df = df[list(columns)]
+
+    return df, survey_sidecar
+
+def _merge_all_data(survey_path, sidecar_path, bct_path, bct2_path, eat_pre_path, eat_post_path):
+    import json
+    import pandas as pd
+
     with open(sidecar_path, "r") as f:
         survey_sidecar = json.load(f)
 
@@ -68,19 +298,137 @@ def load_all_data(exclude=False):
         ).merge(eat_pre, on="participant_id"
         ).merge(eat_post, on="participant_id", suffixes=("_pre", "_post"))
 
-    # Add delta (difference) columns for all the EAT measures.
-    for col in df:
-        if col.endswith("_post"):
-            pre_col = col.replace("_post", "_pre")
-            diff_col = col.replace("_post", "_delta")
-            df[diff_col] = df[col].sub(df[pre_col])
-
-    if exclude:
-        df = df[df["included"]].reset_index(drop=True)
+    # Add delta (difference) columns for all the EAT measures, all at once.
+    post_columns = [ c for c in df if c.endswith("_post") ]
+    pre_columns = [ c.replace("_post", "_pre") for c in post_columns ]
+    delta_columns = [ c.replace("_post", "_delta") for c in post_columns ]
+    deltas = df[post_columns].sub(df[pre_columns].set_axis(post_columns, axis=1)
+        ).set_axis(delta_columns, axis=1)
+    df = pd.concat([df, deltas], axis=1)
 
     return df, survey_sidecar
 
 
+def file_hash(filepath, chunk_size=2**20):
+    """Return the sha256 hex digest of a file's contents."""
+    import hashlib
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ConversionManifest:
+    """Record of converted source files, so conversions can skip files
+    that haven't changed. A source file is current when its contents,
+    the conversion code, and config.json all hash the same as when it was
+    last converted, and all of its outputs still exist.
+    Kept in derivatives/cache/<name>_manifest.json.
+    """
+    def __init__(self, name, code_paths):
+        import json
+        import os
+        self.path = os.path.join(cache_dir(), f"{name}_manifest.json")
+        utils_path = os.path.abspath(__file__)
+        config_path = os.path.join(os.path.dirname(utils_path), "config.json")
+        self.code_hash = "".join( file_hash(p) for p in [*code_paths, utils_path, config_path] )
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def source_hash(self, source_path):
+        """Hash of a source file, reusing the recorded one while its size and mtime are unchanged."""
+        import os
+        stat = os.stat(source_path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        entry = self.entries.get(source_path, {})
+        if entry.get("stamp") == stamp:
+            return entry["source"]
+        return file_hash(source_path)
+
+    def is_current(self, source_path):
+        import os
+        entry = self.entries.get(source_path)
+        return (entry is not None
+            and entry["code"] == self.code_hash
+            and entry["source"] == self.source_hash(source_path)
+            and all(map(os.path.exists, entry["outputs"])))
+
+    def record(self, source_path, output_paths):
+        import os
+        stat = os.stat(source_path)
+        self.entries[source_path] = {
+            "source": self.source_hash(source_path),
+            "stamp": [stat.st_size, stat.st_mtime_ns],
+            "code": self.code_hash,
+            "outputs": list(output_paths),
+        }
+
+    def save(self):
+        import json
+        write_if_changed(self.path, json.dumps(self.entries, indent=1, sort_keys=True))
+
+
+def _timed_conversion(convert, source_path):
+    import time
+    import traceback
+    t0 = time.perf_counter()
+    try:
+        output_paths, error = convert(source_path), None
+    except Exception:
+        output_paths, error = [], traceback.format_exc()
+    return source_path, output_paths, time.perf_counter() - t0, error
+
+def run_conversions(convert, file_list, manifest, n_jobs=1):
+    """Run convert(source_path) -> output paths over every file, on a pool of
+    n_jobs processes, recording successes in the manifest. Prints the time
+    each file took, and exits with the tracebacks if any file failed.
+    """
+    import os
+    import sys
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+    results = []
+    if n_jobs > 1 and len(file_list) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(partial(_timed_conversion, convert), file_list))
+    else:
+        results = [ _timed_conversion(convert, f) for f in file_list ]
+    failures = []
+    for source_path, output_paths, elapsed, error in results:
+        if error is None:
+            manifest.record(source_path, output_paths)
+            print(f"{os.path.basename(source_path)}: {elapsed:.2f} s")
+        else:
+            failures.append(f"{source_path} failed after {elapsed:.2f} s\n{error}")
+    manifest.save()
+    if failures:
+        sys.exit("\n".join(failures))
+    return results
+
+
+def write_if_changed(filepath, text):
+    """Write text to filepath unless the file already holds exactly that text,
+    so unchanged outputs keep their mtime. The file is written then renamed,
+    so it is never left half-written (the tmp name starts with "." to keep
+    it out of globs). Returns True if the file was written.
+    """
+    import os
+    data = text.encode("utf-8")
+    if os.path.exists(filepath) and os.path.getsize(filepath) == len(data):
+        with open(filepath, "rb") as f:
+            if f.read() == data:
+                return False
+    make_pathdir_if_not_exists(filepath)
+    tmp_path = os.path.join(os.path.dirname(filepath), f".{os.path.basename(filepath)}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, filepath)
+    return True
+
+
 def make_pathdir_if_not_exists(filepath):
     import os
     directory = os.path.dirname(filepath)
@@ -94,8 +442,8 @@ def pretty_sidecar_export(obj, data_filepath):
     basename_noext, _ = os.path.splitext(basename)
     basename_sidecar = f"{basename_noext}.json"
     sidecar_filepath = os.path.join(directory, basename_sidecar)
-    with open(sidecar_filepath, "w", encoding="utf-8") as fp:
-        json.dump(obj, fp, indent=4, sort_keys=False, ensure_ascii=True)
+    write_if_changed(sidecar_filepath, json.dumps(obj, indent=4, sort_keys=False, ensure_ascii=True))
+    return sidecar_filepath
 
 def filename2labels(filename):
     import os
@@ -105,60 +453,413 @@ def filename2labels(filename):
         basename_noext = basename_noext[::-1].split("_", 1)[-1][::-1] # remove extra tag
     return basename_noext.split("_")
 
-def stack_raw_task_data(task_label):
-    import os
+# Column types of the raw task data. Categories come from the "Levels"
+# that source2raw-*.py write into each task sidecar, or from the data
+# itself for categorical columns without levels (eg, EAT stimulus).
+TASK_SCHEMAS = {
+    "bct": {
+        "cycle": "int16",
+        "press": "int16",
+        "response": "category",
+        "response_time": "float64",
+        "press_accuracy": "category",
+    },
+    "eat": {
+        "trial_number": "int8",
+        "stimulus": "category",
+        "time": "float32",
+        "response": "float32",
+    },
+}
+
+def task_dtypes(task_label, sidecar_path):
+    """Return the read_csv dtypes for a task and the columns that
+    still need converting to categoricals after stacking.
+    """
+    import json
     import pandas as pd
-    walk_dir = os.path.join(load_config().bids_root)
-    file_list = []
-    for root, dirs, files in os.walk(walk_dir):
-        for name in files:
-            if f"task-{task_label}" in name and name.endswith("_beh.tsv"):
-                full_path = os.path.join(root, name)
-                file_list.append(full_path)
-    file_list = sorted(file_list)
-    df_list = []
-    for file in file_list:
-        _df = pd.read_csv(file, sep="\t")
-        if "acq-" in file:
-            sub, _, acq = filename2labels(file)
-            index = pd.MultiIndex.from_tuples([(sub, acq)]*len(_df), names=["participant_id", "acquisition_id"])
+    with open(sidecar_path, "r", encoding="utf-8") as f:
+        sidecar = json.load(f)
+    dtypes = {}
+    categorize_later = []
+    for column, dtype in TASK_SCHEMAS.get(task_label, {}).items():
+        if dtype != "category":
+            dtypes[column] = dtype
+        elif "Levels" in sidecar.get(column, {}):
+            dtypes[column] = pd.CategoricalDtype(list(sidecar[column]["Levels"]))
         else:
-            sub, _ = filename2labels(file)
-            index = pd.Index([sub]*len(_df), name="participant_id")
-        _df.index = index
-        df_list.append(_df)
-    df = pd.concat(df_list, ignore_index=False)
+            categorize_later.append(column)
+    return dtypes, categorize_later
+
+def task_store_dir(task_label):
+    """Directory of the task's consolidated Parquet dataset, partitioned
+    by participant (and acquisition), eg .../task-eat/participant_id=sub-001/acquisition_id=acq-pre
+    """
+    import os
+    return os.path.join(load_config().bids_root, "derivatives", "parquet", f"task-{task_label}")
+
+def export_task_partition(df, data_filepath, task_label):
+    """Write one participant's raw task data into the task's Parquet dataset,
+    typed with the task schema. The BIDS TSV at data_filepath (already written,
+    with its sidecar) stays the canonical export. Skipped without pyarrow.
+    Returns the list of files written.
+    """
+    import os
+    if not _has_pyarrow():
+        return []
+    labels = filename2labels(data_filepath)
+    partition = [f"participant_id={labels[0]}"]
+    if len(labels) == 3:
+        partition.append(f"acquisition_id={labels[2]}")
+    dtypes, categorize_later = task_dtypes(task_label, data_filepath.replace(".tsv", ".json"))
+    df = df.astype(dtypes).astype({ c: "category" for c in categorize_later })
+    partition_path = os.path.join(task_store_dir(task_label), *partition, "data.parquet")
+    make_pathdir_if_not_exists(partition_path)
+    # Write then rename. The tmp name starts with "." so that reading the
+    # dataset directory skips it while it's being written (or if left behind).
+    tmp_path = os.path.join(os.path.dirname(partition_path), f".data.parquet.{os.getpid()}.tmp")
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, partition_path)
+    return [partition_path]
+
+def stack_raw_task_data(task_label, participants=None, acquisitions=None,
+        stimuli=None, columns=None, exclude=False):
+    """Stack every participant's raw data for a task into one frame
+    indexed by participant (and acquisition). Reads the consolidated
+    Parquet dataset when it covers all of the BIDS TSVs, otherwise the TSVs.
+
+    participants, acquisitions and stimuli restrict what gets loaded
+    (eg, participants=["sub-001"], acquisitions=["acq-pre"], stimuli=["ID113_vid3"]),
+    and columns picks which data columns are read. With exclude, participants
+    listed in the config's participant_exclusions are skipped.
+    Files and columns that aren't needed are never read.
+    """
+    import glob
+    import os
+    file_list = find_bids_files(task=task_label, suffix="beh", extension=".tsv")
+    store_list = sorted(glob.glob(os.path.join(task_store_dir(task_label), "**", "*.parquet"), recursive=True))
+    sidecar_path = file_list[0].replace(".tsv", ".json")
+    # Only use the store if its partitions are exactly the TSVs' participants (and acquisitions).
+    store_labels = { tuple( part.split("=", 1)[1] for part in
+            os.path.relpath(os.path.dirname(p), task_store_dir(task_label)).split(os.sep) )
+        for p in store_list }
+    file_labels = { (labels[0], *labels[2:3]) for labels in map(filename2labels, file_list) }
+    use_store = len(store_list) == len(file_list) and store_labels == file_labels and _has_pyarrow()
+
+    # Narrow the participants and acquisitions down to the files that will be read.
+    if participants is not None:
+        participants = { p if p.startswith("sub-") else f"sub-{p}" for p in participants }
+    if acquisitions is not None:
+        acquisitions = { a if a.startswith("acq-") else f"acq-{a}" for a in acquisitions }
+    exclusions = load_config(as_object=False)["participant_exclusions"] if exclude else {}
+    def wanted(labels):
+        return (labels[0] not in exclusions
+            and (participants is None or labels[0] in participants)
+            and (acquisitions is None or len(labels) < 3 or labels[2] in acquisitions))
+    selected_list = [ f for f in file_list if wanted(filename2labels(f)) ]
+    if not selected_list:
+        raise ValueError(f"No task-{task_label} files match the selection.")
+    if participants is not None or exclude:
+        participants = sorted({ filename2labels(f)[0] for f in selected_list })
+    if acquisitions is not None:
+        acquisitions = sorted(acquisitions)
+    if stimuli is not None:
+        stimuli = sorted(stimuli)
+    if columns is not None:
+        columns = list(columns)
+
+    key = (task_label, use_store, str(participants), str(acquisitions), str(stimuli), str(columns))
+    if use_store:
+        loader = lambda: _read_task_store(task_label, sidecar_path,
+            participants, acquisitions, stimuli, columns)
+        return cached_frames(key, store_list, loader)
+    loader = lambda: _stack_files(selected_list, task_label, stimuli, columns)
+    return cached_frames(key, selected_list, loader)
+
+def _has_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    return True
+
+def _read_task_store(task_label, sidecar_path, participants=None, acquisitions=None, stimuli=None, columns=None):
+    import pandas as pd
+    store_dir = task_store_dir(task_label)
+    index_columns = ["participant_id"]
+    if any(name.startswith("acquisition_id=") for name in _first_partition_listing(store_dir)):
+        index_columns.append("acquisition_id")
+    filters = []
+    if participants is not None:
+        filters.append(("participant_id", "in", list(participants)))
+    if acquisitions is not None and "acquisition_id" in index_columns:
+        filters.append(("acquisition_id", "in", list(acquisitions)))
+    if stimuli is not None:
+        filters.append(("stimulus", "in", list(stimuli)))
+    read_columns = None if columns is None else index_columns + columns
+    df = pd.read_parquet(store_dir, columns=read_columns, filters=filters or None)
+    _, categorize_later = task_dtypes(task_label, sidecar_path)
+    for column in categorize_later:
+        if column in df:
+            # Partitions each have their own categories, so put the combined ones in order.
+            df[column] = df[column].astype("category")
+            df[column] = df[column].cat.set_categories(sorted(df[column].cat.categories))
+    for column in index_columns:
+        df[column] = df[column].cat.remove_unused_categories()
+    return df.set_index(index_columns)
+
+def _first_partition_listing(store_dir):
+    import os
+    first_partition = sorted(os.listdir(store_dir))[0]
+    return os.listdir(os.path.join(store_dir, first_partition))
+
+def _stack_files(file_list, task_label, stimuli=None, columns=None):
+    """Read task files concurrently and stack them, labeling rows with
+    categorical participant (and acquisition) index levels.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+    import pandas as pd
+    dtypes, categorize_later = task_dtypes(task_label, file_list[0].replace(".tsv", ".json"))
+    read_columns = columns
+    if columns is not None and stimuli is not None and "stimulus" not in columns:
+        read_columns = columns + ["stimulus"]
+    def read_file(filepath):
+        _df = pd.read_csv(filepath, sep="\t", dtype=dtypes, usecols=read_columns)
+        if stimuli is not None:
+            _df = _df[_df["stimulus"].isin(stimuli)]
+        return _df
+    # pandas' C parser releases the GIL, so threads overlap the reads and parsing.
+    with ThreadPoolExecutor() as pool:
+        df_list = list(pool.map(read_file, file_list))
+    lengths = [ len(_df) for _df in df_list ]
+    df = pd.concat(df_list, ignore_index=True)
+    if columns is not None:
+        df = df[columns]
+    for column in categorize_later:
+        if column in df:
+            df[column] = df[column].astype("category")
+    labels = [ filename2labels(f) for f in file_list ]
+    def repeated_categorical(file_labels):
+        categories, codes = np.unique(file_labels, return_inverse=True)
+        return pd.Categorical.from_codes(np.repeat(codes, lengths), categories=categories
+            ).remove_unused_categories()
+    participants = repeated_categorical([ l[0] for l in labels ])
+    if all(len(l) == 3 for l in labels): # sub, task, acq
+        acquisitions = repeated_categorical([ l[2] for l in labels ])
+        df.index = pd.MultiIndex.from_arrays([participants, acquisitions],
+            names=["participant_id", "acquisition_id"])
+    else:
+        df.index = pd.CategoricalIndex(participants, name="participant_id")
     return df
 
 
-def get_true_timecourses(video_id):
-    """Load the SEND actor and crowd ratings of emotions"""
+BCT_ACCURACY_LEVELS = ["correct", "undershoot", "overshoot", "selfcaught"]
+
+def score_bct_presses(press, response, target=9,
+        target_response="right", nontarget_response="left", reset_response="space"):
+    """Score the accuracy of every BCT press at once.
+
+    press is the press count within each cycle and response the button
+    pressed. Returns a Categorical of correct/undershoot/overshoot/selfcaught.
+    Works as cycle accuracy too if applied to the last press of each cycle.
+    """
+    import numpy as np
+    import pandas as pd
+    press = np.asarray(press)
+    response = np.asarray(response, dtype=object)
+    is_reset = response == reset_response
+    is_target = response == target_response
+    is_nontarget = response == nontarget_response
+    # Same precedence as the original row-by-row rules.
+    conditions = [
+        is_reset,
+        is_target & (press == target),
+        press > target,
+        (press == target) & is_nontarget,
+        (press < target) & is_nontarget,
+        (press < target) & is_target,
+    ]
+    choices = [ BCT_ACCURACY_LEVELS.index(level) for level in
+        ["selfcaught", "correct", "overshoot", "overshoot", "correct", "undershoot"] ]
+    codes = np.select(conditions, choices, default=-1)
+    if np.any(codes == -1):
+        raise ValueError("Unexpected press/response combination")
+    return pd.Categorical.from_codes(codes, categories=BCT_ACCURACY_LEVELS)
+
+def score_bct_cycles(df, **scoring_kwargs):
+    """Cycle-level BCT table from the stacked press data, in one pass.
+
+    Presses must be in order within each participant and cycle (as
+    stack_raw_task_data returns them). Returns a frame indexed by
+    participant and cycle with the mean and standard deviation of
+    the response times, the cycle accuracy (accuracy of the cycle's
+    last press, see score_bct_presses) and whether it was correct.
+    """
+    import numpy as np
+    import pandas as pd
+    participants = df.index.get_level_values("participant_id")
+    participant_codes = pd.Categorical(participants).codes
+    cycles = df["cycle"].to_numpy()
+    response_times = df["response_time"].to_numpy(dtype=float)
+    # A new cycle starts wherever the participant or the cycle number changes.
+    is_start = np.ones(len(df), dtype=bool)
+    is_start[1:] = (participant_codes[1:] != participant_codes[:-1]) | (cycles[1:] != cycles[:-1])
+    starts = np.flatnonzero(is_start)
+    ends = np.append(starts[1:], len(df))
+    n_presses = ends - starts
+    means = np.add.reduceat(response_times, starts) / n_presses
+    squared_deviations = (response_times - np.repeat(means, n_presses)) ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stds = np.sqrt(np.add.reduceat(squared_deviations, starts) / (n_presses - 1))
+    stds[n_presses == 1] = np.nan
+    last = ends - 1
+    cycle_accuracy = score_bct_presses(df["press"].to_numpy()[last],
+        df["response"].to_numpy()[last], **scoring_kwargs)
+    index = pd.MultiIndex.from_arrays([participants[starts], cycles[starts]],
+        names=["participant_id", "cycle"])
+    cycle_df = pd.DataFrame({
+            "response_time-mean": means,
+            "response_time-std": stds,
+            "cycle_accuracy": cycle_accuracy,
+        }, index=index)
+    cycle_df["cycle_correct"] = cycle_df["cycle_accuracy"].eq("correct")
+    return cycle_df
+
+
+# Decoded SEND ratings already opened in this process, by (archive key, video ID).
+_send_ratings = {}
+SEND_CACHE_MAX_VIDEOS = 500
+SEND_TRANSFORMS = {None: 0, "zscore": 1, "rank": 2}
+
+def _send_archive():
+    """Paths to the SEND ratings archive and its password, and a key
+    that changes whenever the archive does.
+    """
+    import os
+    zip_path = os.path.join(load_config().bids_root, "stimuli", "SENDv1_featuresRatings_pw.zip")
+    password_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db_pword.txt")
+    stat = os.stat(zip_path)
+    archive_key = f"{stat.st_size}-{stat.st_mtime_ns}"
+    return zip_path, password_path, archive_key
+
+def _decode_send_ratings(zip_path, password_path, video_ids):
+    """Decrypt and parse the actor and crowd ratings of several videos
+    from the SEND archive, opening it only once.
+    Returns a dict of video ID to (actor_ratings, crowd_ratings) lists.
+    """
     import csv
     import zipfile
     from io import TextIOWrapper
 
-    with open("db_pword.txt", "rb") as f:
+    with open(password_path, "rb") as f:
         db_pword = f.read()
-    ratings_zip_path = "../stimuli/SENDv1_featuresRatings_pw.zip"
-    actor_id = video_id[2:5] # the actor ID
-    actor_nid = video_id[-1] # specifies which of N videos from this actor
-    path_basename = f"target_{actor_id}_{actor_nid}_normal.csv"
-    # Roam through the train/test/valid files to see where this actor's ratings are located.
-    with zipfile.ZipFile(ratings_zip_path, "r") as z:
+    ratings = {}
+    with zipfile.ZipFile(zip_path, "r") as z:
         z.setpassword(db_pword)
+        # Index the train/test/valid actor ratings files by actor ID and clip number
+        # (eg, "ratings/train/target/target_113_3_normal.csv" -> ("113", "3")).
+        members = {}
         for fn in z.namelist():
-            if fn.startswith("ratings") and fn.endswith(path_basename):
-                with z.open(fn) as f:
-                    reader = csv.DictReader(TextIOWrapper(f, "utf-8"), delimiter=",")
-                    actor_ratings = [ float(row[" rating"]) for row in reader ]
-                # same for crowd
-                fn_crowd = fn.replace("target_", "results_"
-                    ).replace("_normal", ""
-                    ).replace("target", "observer_EWE")
-                with z.open(fn_crowd) as f:
-                    reader = csv.DictReader(TextIOWrapper(f, "utf-8"), delimiter=",")
-                    crowd_ratings = [ float(row["evaluatorWeightedEstimate"]) for row in reader ]
-                return actor_ratings, crowd_ratings
+            basename = fn.rsplit("/", 1)[-1]
+            if fn.startswith("ratings") and basename.startswith("target_") and basename.endswith("_normal.csv"):
+                _, actor_id, actor_nid, _ = basename.split("_")
+                members[(actor_id, actor_nid)] = fn
+        for video_id in video_ids:
+            actor_id = video_id[2:5] # the actor ID
+            actor_nid = video_id[-1] # specifies which of N videos from this actor
+            if (actor_id, actor_nid) not in members:
+                raise ValueError(f"No SEND ratings found for {video_id}")
+            fn = members[(actor_id, actor_nid)]
+            with z.open(fn) as f:
+                reader = csv.DictReader(TextIOWrapper(f, "utf-8"), delimiter=",")
+                actor_ratings = [ float(row[" rating"]) for row in reader ]
+            # same for crowd
+            fn_crowd = fn.replace("target_", "results_"
+                ).replace("_normal", ""
+                ).replace("target", "observer_EWE")
+            with z.open(fn_crowd) as f:
+                reader = csv.DictReader(TextIOWrapper(f, "utf-8"), delimiter=",")
+                crowd_ratings = [ float(row["evaluatorWeightedEstimate"]) for row in reader ]
+            ratings[video_id] = (actor_ratings, crowd_ratings)
+    return ratings
+
+def _save_send_ratings(video_dir, source, ratings):
+    """Save one rating source as a (3, n_samples) array of raw, z-scored and ranked ratings."""
+    import os
+    import numpy as np
+    from scipy import stats
+    ratings = np.asarray(ratings, dtype=float)
+    rows = np.vstack([ratings, stats.zscore(ratings), stats.rankdata(ratings)])
+    path = os.path.join(video_dir, f"{source}.npy")
+    make_pathdir_if_not_exists(path)
+    # Write then rename, so concurrent readers never see a partial file.
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, rows)
+    os.replace(tmp_path, path)
+
+def _evict_send_cache(archive_key):
+    """Drop cached ratings from older archives and the least recently used beyond the cap."""
+    import glob
+    import os
+    import shutil
+    send_dir = os.path.join(cache_dir(), "send")
+    for name in os.listdir(send_dir):
+        if name != archive_key:
+            shutil.rmtree(os.path.join(send_dir, name), ignore_errors=True)
+    video_dirs = sorted(glob.glob(os.path.join(send_dir, archive_key, "*")), key=os.path.getmtime)
+    for video_dir in video_dirs[:max(0, len(video_dirs) - SEND_CACHE_MAX_VIDEOS)]:
+        shutil.rmtree(video_dir, ignore_errors=True)
+
+def get_true_timecourses_many(video_ids, transform=None):
+    """Load the SEND actor and crowd ratings of emotions for several videos.
+
+    Ratings are decoded from the password-protected archive once and
+    cached in derivatives/cache/send, so later calls (in any process)
+    are memory-mapped reads. Videos not cached yet are decoded together
+    in a single pass over the archive. transform selects the raw ratings
+    (None), their z-scores ("zscore") or their ranks ("rank").
+    Returns a dict of video ID to (actor_ratings, crowd_ratings),
+    as read-only float arrays.
+    """
+    import os
+    import numpy as np
+    row = SEND_TRANSFORMS[transform]
+    zip_path, password_path, archive_key = _send_archive()
+    video_ids = list(dict.fromkeys(video_ids))
+    cache_paths = {}
+    missing = []
+    for video_id in video_ids:
+        if (archive_key, video_id) in _send_ratings:
+            continue
+        video_dir = os.path.join(cache_dir(), "send", archive_key, video_id)
+        cache_paths[video_id] = [ os.path.join(video_dir, f"{source}.npy") for source in ["actor", "crowd"] ]
+        if all(map(os.path.exists, cache_paths[video_id])):
+            os.utime(video_dir) # mark as recently used
+        else:
+            missing.append(video_id)
+    if missing:
+        decoded = _decode_send_ratings(zip_path, password_path, missing)
+        for video_id, (actor_ratings, crowd_ratings) in decoded.items():
+            video_dir = os.path.join(cache_dir(), "send", archive_key, video_id)
+            _save_send_ratings(video_dir, "actor", actor_ratings)
+            _save_send_ratings(video_dir, "crowd", crowd_ratings)
+    for video_id, paths in cache_paths.items():
+        _send_ratings[(archive_key, video_id)] = tuple( np.load(p, mmap_mode="r") for p in paths )
+    if missing:
+        _evict_send_cache(archive_key)
+    timecourses = {}
+    for video_id in video_ids:
+        actor, crowd = _send_ratings[(archive_key, video_id)]
+        timecourses[video_id] = (actor[row], crowd[row])
+    return timecourses
+
+def get_true_timecourses(video_id, transform=None):
+    """Load the SEND actor and crowd ratings of emotions for one video.
+    See get_true_timecourses_many.
+    """
+    return get_true_timecourses_many([video_id], transform)[video_id]
 
 # def save_raw_subject_files(basename, subdir=None):
 #     import os